@@ -0,0 +1,260 @@
+'''
+Benchmark construct_data, get_benchmark_problems and all datahandlers on a
+synthetic dataset, and store the results per commit.
+
+  python -m benchmarks.bench --problems 100000 --logbook 50000
+
+The dataset is generated (once, offline) into 'benchmark_data'. Each case
+is run once for wall and cpu time, and once more with tracemalloc for peak
+memory. For datahandlers, 'compute' is computing the declared inputs, and
+'render' the datahandler call itself. Results are written to
+'benchmarks/results/<commit>.json', and compared with the latest earlier
+result of the same dataset.
+'''
+import os
+import sys
+import gc
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import contextlib
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.synthetic import write_dataset
+from datahandlers.data import DATAHANDLERS
+from run import construct_data, get_benchmark_problems
+from utils.cache import load_problem_store
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+PROBLEM_FILE = os.path.join('MoonBoard', 'problems MoonBoard 2016 .json')
+
+
+def git_commit():
+    '''
+    Short hash of current commit, with '-dirty' if there are changes
+    '''
+    def git(*args):
+        return subprocess.run(
+            ['git', *args], cwd=REPO_DIR, capture_output=True,
+            text=True).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    if git('status', '--porcelain', '--untracked-files=no'):
+        commit += '-dirty'
+    return commit
+
+
+def measure(function, args, memory=False):
+    '''
+    Call function(*args), and measure wall and cpu time, or peak memory
+    '''
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    # Datahandlers print a lot
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args)
+    result = {
+        'wall': time.perf_counter() - wall,
+        'cpu': time.process_time() - cpu,
+        }
+    if memory:
+        result = {'peak_mb': tracemalloc.get_traced_memory()[1] / 2**20}
+        tracemalloc.stop()
+    close_figures()
+    return result
+
+
+def close_figures():
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+
+def clear_problem_cache():
+    shutil.rmtree('problem_cache', ignore_errors=True)
+
+
+def load_logbook():
+    with open(os.path.join('MoonBoard', 'logbook.json')) as json_file:
+        return json.load(json_file)
+
+
+def new_data():
+    return construct_data(
+        logbook_data=load_logbook(), problem_file=PROBLEM_FILE)
+
+
+def compute_all(data):
+    # Compute all entries
+    for key in data:
+        data[key]
+
+
+def benchmark_subset(data, num):
+    '''
+    Problem store with only the first num benchmarks, to limit rendering
+    '''
+    store = data['problem_store']
+    return store.subset(np.flatnonzero(store.is_benchmark)[:num])
+
+
+def cases(max_rendered):
+    '''
+    Generate (name, setup, function) of all cases. Setup is not measured,
+    and returns arguments of function.
+    '''
+    yield ('get_benchmark_problems (cold cache)',
+           lambda: clear_problem_cache() or (),
+           get_benchmark_problems)
+    yield ('get_benchmark_problems', lambda: (), get_benchmark_problems)
+    yield ('construct_data (cold cache)',
+           lambda: clear_problem_cache() or (new_data(),),
+           compute_all)
+    yield ('construct_data', lambda: (new_data(),), compute_all)
+
+    for name, datahandler_class in sorted(DATAHANDLERS.items()):
+        def compute_setup(datahandler_class=datahandler_class):
+            load_problem_store(PROBLEM_FILE)
+            return datahandler_class(save_dir='Output'), new_data()
+
+        def render_setup(datahandler_class=datahandler_class):
+            datahandler = datahandler_class(save_dir='Output')
+            data = new_data()
+            if datahandler_class.__name__ == 'Benchmarks':
+                data.update({
+                    'problem_store': benchmark_subset(data, max_rendered)})
+            return datahandler, datahandler.select_inputs(data)
+
+        yield (f'{name} compute', compute_setup,
+               lambda datahandler, data: datahandler.select_inputs(data))
+        yield (f'{name} render', render_setup,
+               lambda datahandler, inputs: datahandler(
+                   **inputs, overwrite=True))
+
+
+def compare(results, reference):
+    '''
+    Print wall time of cases, relative reference
+    '''
+    print(f"Compared with {reference['commit']} ({reference['date']})")
+    for name, result in results['cases'].items():
+        ref = reference['cases'].get(name)
+        if 'wall' not in result or not ref or 'wall' not in ref:
+            continue
+        ratio = result['wall'] / max(ref['wall'], 1e-9)
+        flag = ' SLOWER' if ratio > 1.2 and result['wall'] > 0.05 else ''
+        print(f"{name:50s} {ref['wall']:9.3f}s -> {result['wall']:9.3f}s"
+              f" ({ratio:5.2f}x){flag}")
+
+
+def latest_result(results):
+    '''
+    Latest earlier result of same dataset, or None
+    '''
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    latest = None
+    for filename in os.listdir(RESULTS_DIR):
+        with open(os.path.join(RESULTS_DIR, filename)) as json_file:
+            result = json.load(json_file)
+        if (result['dataset'] == results['dataset']
+                and result['commit'] != results['commit']
+                and (latest is None or result['date'] > latest['date'])):
+            latest = result
+    return latest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--problems', type=int, default=10000,
+                        help="Number of problems of 'MoonBoard 2016 '")
+    parser.add_argument('--holdset-problems', type=int, default=2000,
+                        help='Number of problems of other holdsets')
+    parser.add_argument('--logbook', type=int, default=2000,
+                        help='Number of logbook entries')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='benchmark_data',
+                        help='Folder of generated datasets')
+    parser.add_argument('--max-rendered', type=int, default=50,
+                        help='Number of problems rendered by Benchmarks')
+    parser.add_argument('--filter', default='',
+                        help='Only run cases with names containing this')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip measuring peak memory')
+    parser.add_argument('--compare', help='Commit to compare with')
+    args = parser.parse_args()
+
+    dataset = {
+        'problems': args.problems, 'holdset_problems': args.holdset_problems,
+        'logbook': args.logbook, 'seed': args.seed,
+        'max_rendered': args.max_rendered}
+    folder = os.path.abspath(os.path.join(
+        args.data_dir,
+        f'p{args.problems}_h{args.holdset_problems}_l{args.logbook}'
+        f'_s{args.seed}'))
+    if not os.path.isdir(os.path.join(folder, 'MoonBoard')):
+        print(f"Generating dataset in {folder}")
+        write_dataset(folder, args.problems, args.holdset_problems,
+                      args.logbook, args.seed)
+    # Datahandlers use board images from 'gpx'
+    if not os.path.exists(os.path.join(folder, 'gpx')):
+        os.symlink(os.path.join(REPO_DIR, 'gpx'), os.path.join(folder, 'gpx'))
+    os.chdir(folder)
+
+    import matplotlib
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'dataset': dataset,
+        'cases': {},
+        }
+    for name, setup, function in cases(args.max_rendered):
+        if args.filter not in name:
+            continue
+        try:
+            result = measure(function, setup())
+            if not args.no_memory:
+                result.update(measure(function, setup(), memory=True))
+        except Exception as e:
+            result = {'error': f'{type(e).__name__}: {e}'}
+        results['cases'][name] = result
+        print(f"{name:50s} " + ' '.join(
+            f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+            for k, v in result.items()))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    if os.path.isfile(filename):
+        # Keep other cases of earlier run of same commit and dataset
+        with open(filename) as json_file:
+            earlier = json.load(json_file)
+        if earlier['dataset'] == results['dataset']:
+            results['cases'] = {**earlier['cases'], **results['cases']}
+    with open(filename, 'w') as json_file:
+        json.dump(results, json_file, indent=4)
+    print(f"Results written to {filename}")
+
+    if args.compare:
+        with open(os.path.join(RESULTS_DIR, f'{args.compare}.json')) as f:
+            reference = json.load(f)
+    else:
+        reference = latest_result(results)
+    if reference is not None:
+        compare(results, reference)
+
+
+if __name__ == '__main__':
+    main()
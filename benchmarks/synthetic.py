@@ -0,0 +1,198 @@
+'''
+Generate synthetic problem and logbook files, with the same format as
+downloaded from the MoonBoard api, e.g. to run benchmarks offline.
+
+  python -m benchmarks.synthetic benchmark_data --problems 100000
+'''
+import os
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from utils.holdsets import COLUMN_LETTERS, HOLDSETS
+
+
+GRADES = [
+    '5+', '6A', '6A+', '6B', '6B+', '6C', '6C+', '7A', '7A+', '7B', '7B+',
+    '7C', '7C+', '8A', '8A+', '8B', '8B+']
+# Relative number of problems per grade, roughly as for the 2016 set
+GRADE_WEIGHTS = [2, 6, 10, 14, 16, 14, 11, 9, 6, 4, 3, 2, 1.5, 1, 0.5, 0.3, 0.1]
+
+
+def generate_moves(rng, api_id, num_rows):
+    '''
+    Moves of a problem, with one or two start holds low and an end hold at
+    the top row, and intermediate holds in between
+    '''
+    num_moves = rng.randint(3, 12)
+    start_row = rng.randint(1, 6)
+    rows = sorted(rng.randint(start_row, num_rows - 1)
+                  for _ in range(num_moves - 2))
+    # One or two start holds
+    rows = [start_row] * rng.choice((1, 2)) + rows + [num_rows]
+    num_start = len(rows) - num_moves + 1
+
+    moves = []
+    used = set()
+    for i, row in enumerate(rows):
+        column = rng.randrange(len(COLUMN_LETTERS))
+        description = f'{COLUMN_LETTERS[column]}{row}'
+        if description in used:
+            continue
+        used.add(description)
+        moves.append({
+            'problemId': api_id,
+            'description': description,
+            'isStart': i < num_start,
+            'isEnd': i == len(rows) - 1,
+            })
+    return moves
+
+
+def generate_problem(rng, api_id, holdset, num_rows, date):
+    grade = rng.choices(GRADES, GRADE_WEIGHTS)[0]
+    # User grade is often the same, sometimes one grade off, or missing
+    grade_index = GRADES.index(grade) + rng.choice((-1, 0, 0, 0, 1))
+    grade_index = min(max(grade_index, 0), len(GRADES) - 1)
+    user_grade = rng.choice((GRADES[grade_index], None))
+    # Most problems have few repeats, some a lot
+    repeats = int(rng.paretovariate(0.8)) - 1
+    return {
+        'method': 'Feet follow hands',
+        'name': f'SYNTHETIC PROBLEM {api_id}',
+        'grade': grade,
+        'userGrade': user_grade,
+        'mbType': 0,
+        'moonBoardConfigurationId': 0,
+        'setby': f'setter {rng.randrange(1000)}',
+        'setbyId': f'{rng.randrange(1 << 32):08x}',
+        'userRating': rng.randint(0, 3),
+        'repeats': min(repeats, 100000),
+        'isBenchmark': rng.random() < 0.02,
+        'isAssessmentProblem': False,
+        'problemType': None,
+        'moves': generate_moves(rng, api_id, num_rows),
+        'holdsets': [],
+        'holdsetup': {
+            'id': 0, 'description': holdset, 'setby': None,
+            'dateInserted': None, 'dateUpdated': None, 'dateDeleted': None,
+            'isLocked': False, 'holdsets': None, 'moonBoardConfigurations': None,
+            'holdLayoutId': 0, 'allowClimbMethods': True},
+        'hasBetaVideo': False,
+        'moonBoardConfiguration': None,
+        'apiId': api_id,
+        'dateInserted': date.isoformat(timespec='milliseconds'),
+        'dateUpdated': None,
+        'dateDeleted': None,
+        }
+
+
+def write_problems(filename, rng, holdset, num_problems, first_api_id):
+    '''
+    Write problem file of holdset, one problem at a time
+
+    Return:
+      list of (api_id, grade, is_benchmark) of the problems
+    '''
+    num_rows = HOLDSETS[holdset].num_rows
+    start = datetime(2016, 1, 1)
+    summary = []
+    with open(filename, 'w') as json_file:
+        json_file.write(f'{{"total": {num_problems}, "data": [')
+        for i in range(num_problems):
+            api_id = first_api_id + i
+            date = start + timedelta(minutes=rng.randrange(8*365*24*60))
+            problem = generate_problem(rng, api_id, holdset, num_rows, date)
+            if i:
+                json_file.write(', ')
+            json.dump(problem, json_file)
+            summary.append(
+                (api_id, problem['grade'], problem['isBenchmark']))
+        json_file.write(']}')
+    return summary
+
+
+def generate_logbook(rng, problems, num_entries):
+    '''
+    Logbook of num_entries problems, about half of them benchmarks (if there
+    are enough), sorted by entry date
+
+    Args:
+      problems: list of (api_id, grade, is_benchmark)
+    '''
+    benchmarks = [p for p in problems if p[2]]
+    num_benchmarks = min(len(benchmarks), num_entries // 2)
+    others = [p for p in problems if not p[2]]
+    num_others = min(len(others), num_entries - num_benchmarks)
+    logged = (rng.sample(benchmarks, num_benchmarks)
+              + rng.sample(others, num_others))
+
+    start = datetime(2018, 1, 1)
+    logbook = []
+    for api_id, grade, is_benchmark in logged:
+        # Mostly logged in the evening
+        date = start + timedelta(
+            days=rng.randrange(6*365), hours=rng.choice((10, 17, 18, 19, 20)),
+            minutes=rng.randrange(120), seconds=rng.random()*60)
+        logbook.append({
+            'problem': {'apiId': api_id, 'name': f'SYNTHETIC PROBLEM {api_id}'},
+            'grade': grade,
+            'entryDate': date.isoformat(timespec='milliseconds'),
+            'attempts': rng.randint(1, 10),
+            'comment': '',
+            'rating': rng.randint(0, 3),
+            'isRepeat': False,
+            })
+    logbook.sort(key=lambda log: log['entryDate'])
+    return logbook
+
+
+def write_dataset(folder, num_problems=10000, num_holdset_problems=2000,
+                  num_logbook=2000, seed=0):
+    '''
+    Write problems of all holdsets, and logbook, to 'folder/MoonBoard'
+
+    Args:
+      folder: folder to write to
+      num_problems: number of problems of 'MoonBoard 2016 '
+      num_holdset_problems: number of problems of other holdsets
+      num_logbook: number of logbook entries
+      seed: random seed, same seed gives same dataset
+    '''
+    rng = random.Random(seed)
+    problem_folder = os.path.join(folder, 'MoonBoard')
+    os.makedirs(problem_folder, exist_ok=True)
+
+    problems = []
+    first_api_id = 1
+    for holdset in HOLDSETS:
+        num = (num_problems if holdset == 'MoonBoard 2016 '
+               else num_holdset_problems)
+        filename = os.path.join(problem_folder, f'problems {holdset}.json')
+        problems += write_problems(filename, rng, holdset, num, first_api_id)
+        first_api_id += num
+
+    logbook = generate_logbook(rng, problems, num_logbook)
+    with open(os.path.join(problem_folder, 'logbook.json'), 'w') as json_file:
+        json.dump(logbook, json_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='Folder to write dataset to')
+    parser.add_argument('--problems', type=int, default=10000,
+                        help="Number of problems of 'MoonBoard 2016 '")
+    parser.add_argument('--holdset-problems', type=int, default=2000,
+                        help='Number of problems of other holdsets')
+    parser.add_argument('--logbook', type=int, default=2000,
+                        help='Number of logbook entries')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_dataset(args.folder, args.problems, args.holdset_problems,
+                  args.logbook, args.seed)
+
+
+if __name__ == '__main__':
+    main()
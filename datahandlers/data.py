@@ -3,16 +3,77 @@ import inspect
 import os
 import numpy as np
 from datetime import datetime
-import colorcet as cc
+
+
+def default_cmap(cmap):
+    '''
+    Colormap to use, with colorcet rainbow as default
+
+    colorcet (and matplotlib) is imported here, to only be imported by
+    datahandlers which plot.
+    '''
+    if cmap is None:
+        import colorcet as cc
+        cmap = cc.cm.rainbow
+    return cmap
 
 
 class DataHandler():
     '''
     Base class for datahandler
+
+    'inputs' lists the data entries the datahandler consumes (None meaning
+    all entries), and 'outputs' the entries it returns. Only declared inputs
+    are computed and passed to the datahandler.
     '''
+    inputs = None
+    outputs = ()
+
     def __init__(self, save_dir="./"):
         self.save_dir = save_dir
 
+    # Code versions, with class as key
+    _code_versions = {}
+
+    @classmethod
+    def code_version(cls):
+        '''
+        Hash of the source of the datahandler class and the plot module
+        '''
+        if cls not in cls._code_versions:
+            plot_file = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                '..', 'plots', 'plot.py')
+            with open(plot_file, 'rb') as f:
+                plot_source = f.read()
+            from utils.output_cache import content_hash
+            cls._code_versions[cls] = content_hash(
+                inspect.getsource(cls), plot_source)
+        return cls._code_versions[cls]
+
+    def input_key(self, *inputs):
+        '''
+        Hash of the inputs of some output, and the code version
+        '''
+        from utils.output_cache import content_hash
+        return content_hash(self.code_version(), *inputs)
+
+    def output_cache(self):
+        '''
+        Cache manifest of outputs in save_dir
+        '''
+        from utils.output_cache import OutputCache
+        return OutputCache(self.save_dir)
+
+    @classmethod
+    def select_inputs(cls, data):
+        '''
+        Get dict of the declared inputs available in data
+        '''
+        if cls.inputs is None:
+            return dict(data)
+        return {k: data[k] for k in cls.inputs if k in data}
+
     def __call__(self, logger=None, **kwargs):
         # Return kwargs which are not 'input'/'data'
         return kwargs
@@ -22,43 +83,71 @@ class PrintInfo(DataHandler):
     '''
     Print info about dataset
     '''
-    def __call__(self, problem_list=None,
+    inputs = ('problem_store',)
+
+    def __call__(self, problem_store=None,
                  overwrite=False,
                  **kwargs):
-        print(f"Number of problems: {len(problem_list)}")
-        benchmarks = [p for p in problem_list if p.isBenchmark]
+        print(f"Number of problems: {len(problem_store)}")
+        benchmarks = problem_store.benchmarks()
         print(f"Number of benchmarks:{len(benchmarks)}")
 
-        # Make list of grades
-        list_of_grades = []
-        for bm in benchmarks:
-            grade = bm.grade
-            if grade not in list_of_grades:
-                list_of_grades.append(grade)
-        list_of_grades.sort()
-
-        # Prepare dict of benchmark list, per grade
-        benchmark_per_grade = {}
-        # Initialize empty list
-        for grade in list_of_grades:
-            benchmark_per_grade[grade] = []
-
-        # Loop benchmarks and add to sublists
-        for bm in benchmarks:
-            grade = bm.grade
-            benchmark_per_grade[grade].append(bm)
+        # Count benchmarks per grade code
+        counts = np.bincount(
+            benchmarks.grade, minlength=len(benchmarks.grades))
 
         print("Benchmarks per grade")
-        for grade, bm_list in benchmark_per_grade.items():
-            print(f"  {grade}: {len(bm_list)}")
+        for grade, count in zip(benchmarks.grades, counts):
+            if count:
+                print(f"  {grade}: {count}")
+
+
+# Board canvas of current process, used by '_render_problems'
+_canvas = None
+
+
+def _init_render_worker():
+    # Create board canvas once per process, i.e. load board image only once
+    global _canvas
+    from plots.plot import BoardCanvas
+    _canvas = BoardCanvas()
+
+
+def _render_problems(chunk):
+    '''
+    Render chunk of (filename, (hold ids, is_start, is_end)) to file
+
+    Return:
+      list of (filename, error), where error is None on success
+    '''
+    if _canvas is None:
+        _init_render_worker()
+
+    results = []
+    for filename, holds in chunk:
+        try:
+            _canvas.draw_holds(*holds)
+            _canvas.save(filename)
+        except Exception as e:
+            results.append((filename, repr(e)))
+        else:
+            results.append((filename, None))
+    return results
 
 
 class Benchmarks(DataHandler):
     '''
     Produce Problem view for all benchmark problems
+
+    With workers > 1, problems are rendered in a process pool, in chunks of
+    chunk_size problems.
     '''
-    def __call__(self, problem_list=None,
+    inputs = ('problem_store',)
+
+    def __call__(self, problem_store=None,
                  overwrite=False,
+                 workers=1,
+                 chunk_size=16,
                  **kwargs):
         # Update save_dir with 'class name' subfolder:
         class_name = self.__class__.__name__
@@ -66,38 +155,85 @@ class Benchmarks(DataHandler):
         if not os.path.isdir(self.save_dir):
             os.makedirs(self.save_dir)
 
-        # Get list of all benchmark problems
-        benchmarks = [p for p in problem_list if p.isBenchmark]
+        # Get all benchmark problems
+        benchmark_store = problem_store.benchmarks()
+        cache = self.output_cache()
 
-        # Loop benchmarks and plot problems
-        for bm in benchmarks:
+        # Collect (filename, hold ids) of problems to render
+        jobs = []
+        keys = {}
+        for i in range(len(benchmark_store)):
             # Validate name.
             # Can not containt slash
             # This would be good to do with descriptor?
-            name = bm.name.replace('/', '_')
-            grade = bm.grade
+            name = str(benchmark_store.names[i]).replace('/', '_')
+            grade = benchmark_store.grade_str(benchmark_store.grade[i])
             filename = f"{name}_{grade}.png"
             filename = os.path.join(self.save_dir, filename)
-            print(f"filename:{filename}")
-            if os.path.exists(filename) and not overwrite:
-                # Skip if file already exists
+            key = self.input_key(
+                benchmark_store.holds[i], benchmark_store.start[i],
+                benchmark_store.end[i])
+            if cache.fresh(filename, key) and not overwrite:
+                # Skip if rendered from same problem already
                 continue
-
-            list_of_moves = bm.moves
-            from plots.plot import plot_problem
-            fig, ax = plot_problem(list_of_moves)
-            fig.savefig(filename)
+            jobs.append((filename, benchmark_store.hold_ids(i)))
+            keys[filename] = key
+
+        # Split in chunks, as work units
+        chunks = [jobs[i:i+chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_render_worker) as executor:
+                futures = [executor.submit(_render_problems, chunk)
+                           for chunk in chunks]
+                results = (f.result() for f in as_completed(futures))
+                failed = self._report(results, keys, cache)
+        else:
+            results = (_render_problems(chunk) for chunk in chunks)
+            failed = self._report(results, keys, cache)
+        cache.save()
+
+        if failed:
+            print(f"Failed to render {len(failed)} of {len(jobs)} problems")
+
+    def _report(self, results, keys, cache):
+        '''
+        Print progress and failures per problem, and record rendered in cache
+
+        Return:
+          list of failed filenames
+        '''
+        failed = []
+        done = 0
+        num_jobs = len(keys)
+        for chunk_results in results:
+            for filename, error in chunk_results:
+                done += 1
+                if error is None:
+                    print(f"[{done}/{num_jobs}] filename:{filename}")
+                    cache.record(filename, keys[filename])
+                else:
+                    print(f"[{done}/{num_jobs}] failed:{filename}: {error}")
+                    failed.append(filename)
+        return failed
 
 
 class BenchmarkHoldFrequency(DataHandler):
     '''
     For each grade, visualize which holds are used the most
     '''
+    inputs = (
+        'benchmark_stores_dict', 'benchmark_grades_dict',
+        'benchmark_hold_frequency')
+    outputs = ('benchmark_hold_frequency',)
+
     def __call__(self,
-                 benchmark_problems_dict,
+                 benchmark_stores_dict,
                  benchmark_grades_dict,
-                 # problem_list,
-                 # list_of_grades,
+                 benchmark_hold_frequency=None,
                  overwrite=False,
                  **kwargs):
 
@@ -107,60 +243,68 @@ class BenchmarkHoldFrequency(DataHandler):
         if not os.path.isdir(self.save_dir):
             os.makedirs(self.save_dir)
 
-        from utils.utils import add_dicts
-        for holdset, benchmarks in benchmark_problems_dict.items():
+        # Count holds per (holdset, grade) for all holdsets at once
+        if benchmark_hold_frequency is None:
+            from utils.store import hold_frequency
+            holdsets = list(benchmark_stores_dict.keys())
+            grades = sorted(set(
+                g for mapping in benchmark_grades_dict.values()
+                for g in mapping))
+            counts = hold_frequency(
+                [benchmark_stores_dict[h] for h in holdsets], grades,
+                kind='user_grade')
+            benchmark_hold_frequency = {
+                'counts': counts, 'holdsets': holdsets, 'grades': grades}
+
+        counts = benchmark_hold_frequency['counts']
+        holdsets = benchmark_hold_frequency['holdsets']
+        grades = benchmark_hold_frequency['grades']
+        cache = self.output_cache()
+
+        for holdset_index, holdset in enumerate(holdsets):
             # Setup colors
-            grades = np.linspace(0, 1, len(benchmark_grades_dict[holdset]))
-            cmap = cc.cm.rainbow
-            colors = cmap(grades)
+            grade_int_mapping = benchmark_grades_dict[holdset]
+            colors = default_cmap(None)(
+                np.linspace(0, 1, len(grade_int_mapping)))
 
             # Get grades
-            for grade, grade_int in benchmark_grades_dict[holdset].items():
+            for grade, grade_int in grade_int_mapping.items():
                 filename = f"{holdset}_frequency_{grade}.png"
                 filename = os.path.join(self.save_dir, filename)
 
-                if os.path.exists(filename) and not overwrite:
-                    # Skip if file already exists
+                holds_sum = counts[holdset_index, grades.index(grade)]
+                key = self.input_key(
+                    holdset, grade, holds_sum, grade_int,
+                    len(grade_int_mapping))
+                if cache.fresh(filename, key) and not overwrite:
+                    # Skip if rendered from same data already
                     continue
 
-                holds_sum_dict = {}
-                # Loop benchmarks and plot problems
-                for bm in benchmarks:
-                    # if bm.grade != grade:
-                    if bm.userGrade != grade:
-                        continue
-
-                    # Accumulate moves
-                    list_of_moves = bm.moves
-                    moves_dict = {}
-                    for move in list_of_moves:
-                        moves_dict[move.description] = 1
-                    holds_sum_dict = add_dicts(holds_sum_dict, moves_dict)
-
                 from plots.plot import plot_frequency
-                if len(holds_sum_dict) > 0:
-                    if 'Mini' in holdset:
-                        extent = (-1.9, 10+1.10, -1.28, 11+1.65)
-                        size = (8.82, 9.42)
-                    else:
-                        extent = (-1.9, 10+1.14, -1.28, 17+1.77)
-                        size = (8.82, 13.56)
-
+                if holds_sum.any():
+                    # Board image and geometry of holdset
                     fig, ax = plot_frequency(
-                        holds_sum_dict, image_file=f'gpx/{holdset}.png',
-                        color=colors[grade_int], size=size, extent=extent)
+                        holds_sum, holdset=holdset, color=colors[grade_int])
                     fig.suptitle(f'{holdset.strip()}, {grade}', fontsize=30)
 
                     fig.savefig(filename)
+                    cache.record(filename, key)
+        cache.save()
+
+        return {'benchmark_hold_frequency': benchmark_hold_frequency}
 
 
 class HoldFrequency(DataHandler):
     '''
     For each grade, visualize which holds are used the most
     '''
+    inputs = ('problem_store', 'list_of_grades', 'hold_frequency')
+    outputs = ('hold_frequency',)
+
     def __call__(self,
-                 problem_list,
+                 problem_store,
                  list_of_grades,
+                 hold_frequency=None,
                  overwrite=False,
                  **kwargs):
         # Update save_dir with 'class name' subfolder:
@@ -169,31 +313,97 @@ class HoldFrequency(DataHandler):
         if not os.path.isdir(self.save_dir):
             os.makedirs(self.save_dir)
 
-        from utils.utils import add_dicts
-        for grade in list_of_grades:
+        # Count holds per grade, with a single 'holdset'
+        if hold_frequency is None:
+            from utils.store import hold_frequency as count_holds
+            hold_frequency = {
+                'counts': count_holds([problem_store], list_of_grades),
+                'holdsets': [None],
+                'grades': list_of_grades,
+            }
+
+        counts = hold_frequency['counts']
+        cache = self.output_cache()
+        for grade_index, grade in enumerate(hold_frequency['grades']):
             print(f"grade:{grade}")
             filename = f"frequency_{grade}.png"
             filename = os.path.join(self.save_dir, filename)
-            if os.path.exists(filename) and not overwrite:
-                # Skip if file already exists
-                continue
-
-            holds_sum_dict = {}
-            # Loop benchmarks and plot problems
-            for problem in problem_list:
-                if problem.grade != grade:
-                    continue
 
-                # Accumulate moves
-                moves_dict = {}
-                for move in problem.moves:
-                    moves_dict[move.description] = 1
-                holds_sum_dict = add_dicts(holds_sum_dict, moves_dict)
+            holds_sum = counts[0, grade_index]
+            key = self.input_key(holds_sum)
+            if cache.fresh(filename, key) and not overwrite:
+                # Skip if rendered from same data already
+                continue
 
             from plots.plot import plot_frequency
-            if len(holds_sum_dict) > 0:
-                fig, ax = plot_frequency(holds_sum_dict)
+            if holds_sum.any():
+                fig, ax = plot_frequency(holds_sum)
                 fig.savefig(filename)
+                cache.record(filename, key)
+        cache.save()
+
+        return {'hold_frequency': hold_frequency}
+
+
+class SimilarProblems(DataHandler):
+    '''
+    Find the problems most similar to a problem, or a set of holds
+
+    Similarity is the Jaccard overlap of the holds. The problem is given by
+    apiId, or holds by descriptions, with settings e.g.
+    SimilarProblems:"dict(api_id=12345, k=10, grades=['7A', '7A+'])" or
+    SimilarProblems:"dict(holds=['E6', 'G8', 'D18'])"
+    '''
+    inputs = ('similarity_index',)
+    outputs = ('similar_problems',)
+
+    def __call__(self,
+                 similarity_index,
+                 api_id=None,
+                 holds=None,
+                 k=10,
+                 grades=None,
+                 **kwargs):
+        if api_id is None and holds is None:
+            print("SimilarProblems: set api_id or holds in settings")
+            return
+
+        # Update save_dir with 'class name' subfolder:
+        class_name = self.__class__.__name__
+        self.save_dir = os.path.join(self.save_dir, class_name)
+        if not os.path.isdir(self.save_dir):
+            os.makedirs(self.save_dir)
+
+        similar = similarity_index.query(
+            api_id=api_id, holds=holds, k=k, grades=grades)
+
+        print(f"Problems similar to {api_id if api_id is not None else holds}")
+        for problem in similar:
+            print(f"  {problem['similarity']:.2f} {problem['grade']:4s} "
+                  f"{problem['apiId']} {problem['name']}")
+
+        name = api_id if api_id is not None else '_'.join(holds)
+        filename = os.path.join(self.save_dir, f"similar_{name}.json")
+        import json
+        with open(filename, 'w') as json_file:
+            json.dump(similar, json_file, indent=4)
+
+        return {'similar_problems': similar}
+
+
+def series_dates(dates):
+    '''
+    Dates as list of unix time in seconds, for json series
+    '''
+    return dates.astype('datetime64[s]').astype(np.int64).tolist()
+
+
+def series_colors(cmap, num):
+    '''
+    List of 'num' colors evenly spread over colormap, as hex strings
+    '''
+    from matplotlib.colors import to_hex
+    return [to_hex(c) for c in cmap(np.linspace(0, 1, num))]
 
 
 class BenchmarkProgress(DataHandler):
@@ -203,15 +413,18 @@ class BenchmarkProgress(DataHandler):
     Scatter plot of time v. accumulated number of benchmarks.
     This will show the general trend, good and bad spells e.g.
     '''
+    inputs = ('benchmark_logbook_dict', 'benchmark_grades_dict')
+
     def __call__(self,
-                 benchmark_problems_dict,
+                 benchmark_logbook_dict,
                  benchmark_grades_dict,
-                 logbook_dict,
                  overwrite=False,
-                 cmap=cc.cm.rainbow,
+                 cmap=None,
                  dpi=200,
                  save=True,
+                 series=False,
                  **kwargs):
+        cmap = default_cmap(cmap)
         # Update save_dir with 'class name' subfolder:
         class_name = self.__class__.__name__
         self.save_dir = os.path.join(self.save_dir, class_name)
@@ -219,49 +432,44 @@ class BenchmarkProgress(DataHandler):
             os.makedirs(self.save_dir)
 
         figure_dict = {}
+        cache = self.output_cache()
 
-        for holdset, problem_list in benchmark_problems_dict.items():
+        for holdset, logbook_holdset in benchmark_logbook_dict.items():
             filename = f"{class_name}_{holdset}.png"
             filename = os.path.join(self.save_dir, filename)
-            if os.path.exists(filename) and not overwrite:
-                # Skip if file already exists
-                continue
 
-            # Make 'problem_dict' with id as key
-            problem_dict = {}
-            for problem in problem_list:
-                problem_dict[problem.apiId] = problem
+            if not len(logbook_holdset):
+                # Don't plot if logbook is empty for current holdset
+                continue
 
             # Get grades
             grade_int_mapping = benchmark_grades_dict[holdset]
 
-            # Extract problems from logbook for 'current' holdset in loop
-            logbook_holdset = {
-                k: v for k, v in logbook_dict.items() if k in problem_dict}
-            # Sort logbook by entry-date
-            logbook_holdset = dict(sorted(
-                logbook_holdset.items(),
-                key=lambda item: item[1].entryDate))
-
-            if not len(logbook_holdset):
-                # Don't plot if logbook is empty for current holdset
+            # Get sorted entry dates, and accumulated number of problems
+            dates = logbook_holdset.dates
+            num_problems = np.arange(1, len(dates)+1)
+
+            # Get problem grades
+            grades = logbook_holdset.grade_ints(grade_int_mapping)
+
+            if series:
+                # Data to plot, instead of plot
+                figure_dict[holdset] = {
+                    'title': holdset,
+                    'dates': series_dates(dates),
+                    'counts': num_problems.tolist(),
+                    'grades': grades.tolist(),
+                    'grade_names': list(grade_int_mapping),
+                    'colors': series_colors(cmap, len(grade_int_mapping)),
+                }
                 continue
 
-            # Prepare lists
-            dates = []
-            num_problems = []
-            grades = []
-            # Loop all logbook_2016 entries
-            for i, (api_id, entry) in enumerate(logbook_holdset.items()):
-                # Remove fractions of seconds from entry date
-                cut_date = entry.entryDate.split('.')[0]
-                date = datetime.strptime(cut_date, "%Y-%m-%dT%H:%M:%S")
-                dates.append(date)
-                num_problems.append(i+1)
-
-                # Get problem grade
-                problem = problem_dict[api_id]
-                grades.append(grade_int_mapping[problem.grade])
+            key = self.input_key(
+                holdset, dates, grades, list(grade_int_mapping), dpi,
+                cmap.name)
+            if save and cache.fresh(filename, key) and not overwrite:
+                # Skip if plotted from same data already
+                continue
 
             # Produce 'color-array' depending on the grade
             grades = np.divide(grades, len(grade_int_mapping)-1)
@@ -276,9 +484,11 @@ class BenchmarkProgress(DataHandler):
             # Either save directly, or store to return dict of (fig, ax)
             if save:
                 fig.savefig(filename, dpi=dpi, bbox_inches="tight")
+                cache.record(filename, key)
             else:
                 figure_dict[holdset] = (fig, ax)
-        if not save:
+        cache.save()
+        if series or not save:
             return figure_dict
 
 
@@ -288,15 +498,21 @@ class BenchmarkProgressPerGrade(DataHandler):
 
     Step plot of time v. accumulated percentage of benchmarks, per grade.
     '''
+    inputs = (
+        'benchmark_stores_dict', 'benchmark_logbook_dict',
+        'benchmark_grades_dict')
+
     def __call__(self,
-                 benchmark_problems_dict,
+                 benchmark_stores_dict,
+                 benchmark_logbook_dict,
                  benchmark_grades_dict,
-                 logbook_dict,
                  overwrite=False,
-                 cmap=cc.cm.rainbow,
+                 cmap=None,
                  dpi=200,
                  save=True,
+                 series=False,
                  **kwargs):
+        cmap = default_cmap(cmap)
         # Update save_dir with 'class name' subfolder:
         class_name = self.__class__.__name__
         self.save_dir = os.path.join(self.save_dir, class_name)
@@ -304,68 +520,70 @@ class BenchmarkProgressPerGrade(DataHandler):
             os.makedirs(self.save_dir)
 
         figure_dict = {}
+        cache = self.output_cache()
+        today = np.datetime64(datetime.today(), 's')
 
-        for holdset, problem_list in benchmark_problems_dict.items():
+        for holdset, logbook_holdset in benchmark_logbook_dict.items():
             filename = f"{class_name}_{holdset}.png"
             filename = os.path.join(self.save_dir, filename)
-            if os.path.exists(filename) and not overwrite:
-                # Skip if file already exists
-                continue
-
-            # Make 'problem_dict' with id as key
-            problem_dict = {}
-            for problem in problem_list:
-                problem_dict[problem.apiId] = problem
-
-            # Get grades
-            grade_int_mapping = benchmark_grades_dict[holdset]
-
-            # Extract problems from logbook for 'current' holdset in loop
-            logbook_holdset = {
-                k: v for k, v in logbook_dict.items() if k in problem_dict}
-            # Sort logbook by entry-date
-            logbook_holdset = dict(sorted(
-                logbook_holdset.items(),
-                key=lambda item: item[1].entryDate))
 
             if not len(logbook_holdset):
                 # Don't plot if logbook is empty for current holdset
                 continue
 
+            # Get grades
+            grade_int_mapping = benchmark_grades_dict[holdset]
+
             # Calculate total benchmarks per grade
+            store = benchmark_stores_dict[holdset]
+            counts = np.bincount(store.grade, minlength=len(store.grades))
             num_benchmarks_per_grade = [0]*len(grade_int_mapping)
-            for problem in problem_list:
-                grade_int = grade_int_mapping[problem.grade]
-                num_benchmarks_per_grade[grade_int] += 1
-
-            # Prepare lists
-            dates = []
-            num_problems = []
-            grades = []
-            # Loop all logbook_2016 entries
-            for i, (api_id, entry) in enumerate(logbook_holdset.items()):
-                # Remove fractions of seconds from entry date
-                cut_date = entry.entryDate.split('.')[0]
-                date = datetime.strptime(cut_date, "%Y-%m-%dT%H:%M:%S")
-                dates.append(date)
-                num_problems.append(i+1)
-
-                # Get problem grade
-                problem = problem_dict[api_id]
-                grades.append(grade_int_mapping[problem.grade])
+            for grade, grade_int in grade_int_mapping.items():
+                num_benchmarks_per_grade[grade_int] = counts[
+                    store.grades.index(grade)]
+
+            # Get sorted entry dates and problem grades
+            dates = logbook_holdset.dates
+            grades = logbook_holdset.grade_ints(grade_int_mapping)
+
+            # Plot extends to today, so it is part of the key (by day)
+            key = self.input_key(
+                holdset, dates, grades, list(grade_int_mapping),
+                num_benchmarks_per_grade, str(today.astype('datetime64[D]')),
+                dpi, cmap.name)
+            if (save and not series and cache.fresh(filename, key)
+                    and not overwrite):
+                # Skip if plotted from same data already
+                continue
 
             d_list_dict = {}
             for grade, grade_int in grade_int_mapping.items():
-                d_list = []
-                for g, d in zip(grades, dates):
-                    if grade_int == g:
-                        d_list.append(d)
-                # Add today
-                d_list.append(datetime.today())
-                # Sort
-                d_list.sort()
+                # Dates of current grade, and today, sorted
+                d_list = np.sort(np.append(dates[grades == grade_int], today))
                 d_list_dict[grade] = d_list
 
+            if series:
+                # Data to plot, instead of plot. Steps of percent per grade
+                lines = []
+                for grade, dates in d_list_dict.items():
+                    grade_int = grade_int_mapping[grade]
+                    percent = 100*np.divide(
+                        list(range(0, len(dates))),
+                        num_benchmarks_per_grade[grade_int])
+                    if len(dates) == 1:
+                        continue
+                    lines.append({
+                        'grade': grade_int,
+                        'dates': series_dates(dates),
+                        'percent': np.round(percent, 2).tolist()})
+                figure_dict[holdset] = {
+                    'title': f'Progress per grade, {holdset}',
+                    'lines': lines,
+                    'grade_names': list(grade_int_mapping),
+                    'colors': series_colors(cmap, len(grade_int_mapping)),
+                }
+                continue
+
             colors = cmap(np.linspace(0, 1, len(grade_int_mapping)))
 
             # Create figure and axis
@@ -389,9 +607,11 @@ class BenchmarkProgressPerGrade(DataHandler):
             # Either save directly, or store to return dict of (fig, ax)
             if save:
                 fig.savefig(filename, dpi=dpi, bbox_inches="tight")
+                cache.record(filename, key)
             else:
                 figure_dict[holdset] = (fig, ax)
-        if not save:
+        cache.save()
+        if series or not save:
             return figure_dict
 
 
@@ -399,23 +619,25 @@ class Times(DataHandler):
     '''
     What weekdays and times benchmarks have been logged
     '''
+    inputs = (
+        'logbook_store', 'benchmark_logbook_dict', 'benchmark_grades_dict')
+
     def __call__(self,
-                 logbook_dict,
-                 benchmark_problems_dict,
+                 logbook_store,
+                 benchmark_logbook_dict,
                  benchmark_grades_dict,
                  overwrite=False,
-                 cmap=cc.cm.rainbow,
+                 cmap=None,
                  dpi=200,
                  save=True,
+                 series=False,
                  **kwargs):
+        cmap = default_cmap(cmap)
         # Update save_dir with 'class name' subfolder:
         class_name = self.__class__.__name__
 
         filename = f"{class_name}.png"
         filename = os.path.join(self.save_dir, filename)
-        if os.path.exists(filename) and not overwrite:
-            # Skip if file already exists
-            return False
 
         # Loop all holdsets to combine list of grades
         grade_int_mappings = benchmark_grades_dict.values()
@@ -430,31 +652,34 @@ class Times(DataHandler):
         for i, grade in enumerate(list_of_all_grades):
             grade_int_mapping[grade] = i
 
-        # Make a mapping id: problem for all benchmark problems of all holdsets
-        problem_dict = {}
-        for holdset, problem_list in benchmark_problems_dict.items():
-            for problem in problem_list:
-                problem_dict[problem.apiId] = problem
-
-        # Prepare lists
-        dates = []
-        grades = []
-
-        # Loop all logbook entries
-        for i, (api_id, entry) in enumerate(logbook_dict.items()):
-            # Remove fractions of seconds from entry date
-            cut_date = entry.entryDate.split('.')[0]
-            date = datetime.strptime(cut_date, "%Y-%m-%dT%H:%M:%S")
-
-            # Get problem grade from id:benchmark mapping
-            # Skip if not part of benchmarks
-            try:
-                problem = problem_dict[api_id]
-                grades.append(grade_int_mapping[problem.grade])
-            except KeyError:
-                pass
-            else:
-                dates.append(date)
+        # Get logbook entries which are benchmarks of any holdset, and grades
+        joins = benchmark_logbook_dict.values()
+        rows = np.concatenate(
+            [j.rows for j in joins] + [np.zeros(0, dtype=np.intp)])
+        grades = np.concatenate(
+            [j.grade_ints(grade_int_mapping) for j in joins]
+            + [np.zeros(0, dtype=np.int64)])
+
+        # Weekdays as 1-7, and time of day in hours
+        weekdays = logbook_store.weekday[rows] + 1
+        times = logbook_store.hour[rows] + logbook_store.minute[rows]/60.0
+
+        if series:
+            # Data to plot, instead of plot
+            return {
+                'weekdays': weekdays.tolist(),
+                'hours': np.round(times, 3).tolist(),
+                'grades': grades.tolist(),
+                'grade_names': list(grade_int_mapping),
+                'colors': series_colors(cmap, len(grade_int_mapping)),
+            }
+
+        cache = self.output_cache()
+        key = self.input_key(
+            weekdays, times, grades, list(grade_int_mapping), dpi, cmap.name)
+        if save and cache.fresh(filename, key) and not overwrite:
+            # Skip if plotted from same data already
+            return False
 
         # Produce 'color-array' depending on the grade
         grades = np.divide(grades, len(grade_int_mapping.keys())-1)
@@ -477,12 +702,6 @@ class Times(DataHandler):
             7: 'Sunday',
         }
 
-        weekdays = []
-        times = []
-        for d in dates:
-            weekdays.append(d.isoweekday())
-            times.append(d.hour + d.minute/60.0)
-
         # Do plot and add legend
         ax.scatter(weekdays, times, color=colors, edgecolors='k',
                    linewidth=0.5)
@@ -505,6 +724,8 @@ class Times(DataHandler):
 
         if save:
             fig.savefig(filename, dpi=dpi, bbox_inches="tight")
+            cache.record(filename, key)
+            cache.save()
         else:
             return fig, ax
 
@@ -513,14 +734,16 @@ class Session(DataHandler):
     '''
     Test with plotting typical session
     '''
+    inputs = ('problem_logbook', 'list_of_bm_grades')
+
     def __call__(self,
-                 problem_list,
+                 problem_logbook,
                  list_of_bm_grades,
-                 logbook_dict,
                  overwrite=False,
-                 cmap=cc.cm.rainbow,
+                 cmap=None,
                  dpi=200,
                  **kwargs):
+        cmap = default_cmap(cmap)
         # Update save_dir with 'class name' subfolder:
         class_name = self.__class__.__name__
         # self.save_dir = os.path.join(self.save_dir, class_name)
@@ -529,44 +752,21 @@ class Session(DataHandler):
 
         filename = f"{class_name}.png"
         filename = os.path.join(self.save_dir, filename)
-        if os.path.exists(filename) and not overwrite:
-            # Skip if file already exists
-            return False
 
         # Make a mapping from str grade to int
         grade_to_int = {}
         for i, grade in enumerate(list_of_bm_grades):
             grade_to_int[grade] = i
 
-        # Make 'problem_dict' with id as key
-        problem_dict = {}
-        for problem in problem_list:
-            problem_dict[problem.apiId] = problem
-
-        # Extract 2016 problems from logbook
-        # (indirectly, as problem_dict only contains 2016 problems for me)
-        logbook_2016 = {
-            k: v for k, v in logbook_dict.items() if k in problem_dict}
-        # Sort logbook by entry-date
-        logbook_2016 = dict(sorted(
-            logbook_2016.items(),
-            key=lambda item: item[1].entryDate))
-
-        # Prepare lists
-        dates = []
-        num_problems = []
-        grades = []
-        # Loop all logbook_2016 entries
-        for i, (api_id, entry) in enumerate(logbook_2016.items()):
-            # Remove fractions of seconds from entry date
-            cut_date = entry.entryDate.split('.')[0]
-            date = datetime.strptime(cut_date, "%Y-%m-%dT%H:%M:%S")
-            dates.append(date)
-            num_problems.append(i+1)
-
-            # Get problem grade
-            problem = problem_dict[api_id]
-            grades.append(grade_to_int[problem.grade])
+        # Logbook entries of the loaded problems, sorted by entry-date
+        # (indirectly 2016 problems, as the problems only contains 2016 for me)
+        cache = self.output_cache()
+        key = self.input_key(problem_logbook.dates, dpi)
+        if cache.fresh(filename, key) and not overwrite:
+            # Skip if plotted from same data already
+            return False
+        dates = problem_logbook.dates.tolist()
+        grades = problem_logbook.grade_ints(grade_to_int)
 
         # Produce 'color-array' depending on the grade
         grades = np.divide(grades, len(list_of_bm_grades)-1)
@@ -644,53 +844,36 @@ class Session(DataHandler):
         ax.set_ylim(bottom=0)
 
         fig.savefig(filename, dpi=dpi, bbox_inches="tight")
+        cache.record(filename, key)
+        cache.save()
 
 
 class Histograms(DataHandler):
     '''
     Histograms
     '''
+    inputs = ('problem_logbook', 'logbook_store')
+
     def __call__(self,
-                 problem_list,
-                 list_of_bm_grades,
-                 logbook_dict,
+                 problem_logbook,
+                 logbook_store,
                  overwrite=False,
-                 cmap=cc.cm.rainbow,
+                 cmap=None,
                  dpi=200,
                  **kwargs):
+        cmap = default_cmap(cmap)
         # Update save_dir with 'class name' subfolder:
         class_name = self.__class__.__name__
         self.save_dir = os.path.join(self.save_dir, class_name)
         if not os.path.isdir(self.save_dir):
             os.makedirs(self.save_dir)
 
-        # Make 'problem_dict' with id as key
-        problem_dict = {}
-        for problem in problem_list:
-            problem_dict[problem.apiId] = problem
-
-        # Extract 2016 problems from logbook
-        # (indirectly, as problem_dict only contains 2016 problems for me)
-        logbook_2016 = {
-            k: v for k, v in logbook_dict.items() if k in problem_dict}
-        # Sort logbook by entry-date
-        logbook_2016 = dict(sorted(
-            logbook_2016.items(),
-            key=lambda item: item[1].entryDate))
-
-        hours = []
-        weekdays = []
-        months = []
-
-        # Loop all logbook_2016 entries
-        for i, (api_id, entry) in enumerate(logbook_2016.items()):
-            # Remove fractions of seconds from entry date
-            cut_date = entry.entryDate.split('.')[0]
-            date = datetime.strptime(cut_date, "%Y-%m-%dT%H:%M:%S")
-
-            hours.append(date.hour)
-            weekdays.append(date.weekday())
-            months.append(date.month)
+        # Get calendar fields of logbook entries of the loaded problems
+        # (indirectly 2016 problems, as the problems only contains 2016 for me)
+        rows = problem_logbook.rows
+        hours = logbook_store.hour[rows]
+        weekdays = logbook_store.weekday[rows]
+        months = logbook_store.month[rows]
 
         from plots.plot import new_fig
         plots = {
@@ -699,17 +882,22 @@ class Histograms(DataHandler):
             'hours': (range(0, 25), hours)
             }
 
+        cache = self.output_cache()
         for name, (bins, lst) in plots.items():
             filename = f'{name}.png'
             filename = os.path.join(self.save_dir, filename)
-            if os.path.exists(filename) and not overwrite:
-                # Skip if file already exists
-                continue
 
             hist, bin_edges = np.histogram(lst, bins=bins)
+            key = self.input_key(hist, bin_edges, dpi)
+            if cache.fresh(filename, key) and not overwrite:
+                # Skip if plotted from same data already
+                continue
+
             fig, ax = new_fig()
             bar = ax.bar(bin_edges[:-1], hist, width=(bins[1]-bins[0])*0.8)
             fig.savefig(filename, dpi=dpi, bbox_inches="tight")
+            cache.record(filename, key)
+        cache.save()
 
         # bins = range(0, 8)
         # hist, bin_edges = np.histogram(weekdays, bins=bins)
@@ -728,8 +916,10 @@ class RepeatsHistogram(DataHandler):
     '''
     Produce histogram showing how many repeats problems typically have
     '''
+    inputs = ('problem_store', 'list_of_grades')
+
     def __call__(self,
-                 problem_list,
+                 problem_store,
                  list_of_grades,
                  overwrite=False,
                  **kwargs):
@@ -741,12 +931,12 @@ class RepeatsHistogram(DataHandler):
 
         filename = "repeats.png"
         filename = os.path.join(self.save_dir, filename)
-        if os.path.exists(filename) and not overwrite:
-            return False
 
-        list_of_repeats = []
-        for problem in problem_list:
-            list_of_repeats.append(problem.repeats)
+        list_of_repeats = problem_store.repeats
+        cache = self.output_cache()
+        key = self.input_key(list_of_repeats)
+        if cache.fresh(filename, key) and not overwrite:
+            return False
 
         # # Log
         # bins = [0, 1, 10, 100, 1000, 10000, 100000]
@@ -775,8 +965,13 @@ class RepeatsHistogram(DataHandler):
         # ax.set_ylim([0, 1e+4])
         ax.set_yscale('log')
         fig.savefig(filename)
+        cache.record(filename, key)
+        cache.save()
 
 
 # Make a dict of all datahandlers, as dict[name, class]
 clsmembers_pairs = inspect.getmembers(sys.modules[__name__], inspect.isclass)
-DATAHANDLERS = {k: v for (k, v) in clsmembers_pairs if k != 'DataHandler'}
+# (only subclasses of DataHandler, not e.g. imported 'datetime')
+DATAHANDLERS = {
+    k: v for (k, v) in clsmembers_pairs
+    if issubclass(v, DataHandler) and k != 'DataHandler'}
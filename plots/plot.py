@@ -1,9 +1,12 @@
-import matplotlib.pyplot as plt
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from matplotlib.figure import Figure
 import numpy as np
 import colorcet as cc
-import matplotlib
+import matplotlib.image
+import matplotlib.dates
+
+from utils.holdsets import (
+    HOLDSETS, DEFAULT_HOLDSET, HOLD_IDS, HOLD_COORDS, hold_ids)
 
 
 def new_fig(nrows=1, ncols=1, **kwargs):
@@ -38,88 +41,192 @@ def add_grade_legend(ax, list_of_grades, cmap=cc.cm.rainbow):
     ax.legend(handles=handles, loc='right', bbox_to_anchor=(1.2, 0.5))
 
 
-number_to_letter_dict = {
-    0: 'A',
-    1: 'B',
-    2: 'C',
-    3: 'D',
-    4: 'E',
-    5: 'F',
-    6: 'G',
-    7: 'H',
-    8: 'I',
-    9: 'J',
-    10: 'K',
-}
+def desc_to_coords(desc):
+    '''
+    Coordinates of hold description, starting from (0, 0) e.g. E6 -> (4, 5)
 
-letter_to_number_dict = {
-    v: k for k, v in number_to_letter_dict.items()}
+    Return None if not a valid hold
+    '''
+    index = HOLD_IDS.get(desc)
+    if index is None:
+        print(f"hold:{desc}")
+        return None
+    x, y = HOLD_COORDS[index]
+    return int(x), int(y)
 
 
-def desc_to_coords(desc):
+# Decoded board images, with image filename as key
+_board_images = {}
+
+
+def board_image(image_file):
     '''
-    Parse description to coordinates starting from (0, 0) e.g. E6 -> (4, 5)
+    Decoded board image, read from file once per process
     '''
-    # Separate letter and digits
-    letter = desc[0]
-    digits = int(desc[1:])
-    # Return coordinates
-    try:
-        coordinates = (letter_to_number_dict[letter], digits-1)
-    except KeyError:
-        print(f"letter:{letter}")
-        return None
+    if image_file not in _board_images:
+        _board_images[image_file] = matplotlib.image.imread(image_file)
+    return _board_images[image_file]
+
+
+# Marker colors of start, end and intermediate holds
+START_COLOR = 'lime'
+END_COLOR = 'red'
+MOVE_COLOR = 'blue'
+
+
+def hold_marker_data(ids, is_start, is_end):
+    '''
+    Coordinates and colors of the hold markers of a problem
+
+    Args:
+      ids: int array of hold ids
+      is_start, is_end: bool arrays of which holds are start and end holds
+
+    Return:
+      (offsets, colors), array (n, 2) and list of n colors
+    '''
+    colors = np.where(
+        is_start, START_COLOR, np.where(is_end, END_COLOR, MOVE_COLOR))
+    return HOLD_COORDS[ids], colors.tolist()
 
-    return coordinates
+
+def problem_marker_data(list_of_moves):
+    '''
+    Coordinates and colors of the hold markers of a list of Move objects
+    '''
+    ids = hold_ids([move.description for move in list_of_moves])
+    valid = ids >= 0
+    is_start = np.array([move.isStart for move in list_of_moves], dtype=bool)
+    is_end = np.array([move.isEnd for move in list_of_moves], dtype=bool)
+    return hold_marker_data(
+        ids[valid], is_start[valid], is_end[valid])
+
+
+def problem_markers(ax, list_of_moves=(), **kwargs):
+    '''
+    Add one scatter collection with circles for the moves of a problem
+
+    Return:
+      the PathCollection, which can be updated for other problems
+    '''
+    offsets, colors = problem_marker_data(list_of_moves)
+    return ax.scatter(
+        offsets[:, 0], offsets[:, 1], s=3800, alpha=0.9, facecolors='none',
+        edgecolors=colors, linewidth=8, **kwargs)
 
 
 def plot_problem(list_of_moves):
-    fig, ax = new_fig(figsize=(8.82, 13.56))
+    holdset = HOLDSETS[DEFAULT_HOLDSET]
+    fig, ax = new_fig(figsize=holdset.size)
     ax.set_aspect('equal')
-    img = plt.imread("gpx/empty_moonboard_2016.png")
-    ax.imshow(img, extent=(-1.9, 10+1.14, -1.28, 17+1.77))
-
-    for move in list_of_moves:
-        desc = move.description
-        coords = desc_to_coords(desc)
-        if move.isStart:
-            color = 'lime'
-        elif move.isEnd:
-            color = 'red'
-        else:
-            color = 'blue'
-
-        if coords is not None:
-            ax.scatter(
-                *coords, s=3800, alpha=0.9, facecolors='none',
-                edgecolors=color, linewidth=8)
+    img = board_image("gpx/empty_moonboard_2016.png")
+    ax.imshow(img, extent=holdset.extent)
+
+    problem_markers(ax, list_of_moves)
 
     fig.tight_layout()
-    plt.axis('off')
+    ax.axis('off')
     fig.subplots_adjust(left=0.0, right=1.0, top=1.0, bottom=0.0)
 
     return fig, ax
 
 
-def plot_frequency(
-        holds_sum_dict, image_file="gpx/MoonBoard 2016 .png",
-        color='red', size=(8.82, 13.56),
-        extent=(-1.9, 10+1.14, -1.28, 17+1.77)):
-    fig, ax = new_fig(figsize=size)
+class BoardCanvas():
+    '''
+    Board figure with a pre-rendered background, for drawing many problems
+
+    The figure and a single marker collection are created once. The board
+    image is drawn once and the rendered buffer stored, and drawing a problem
+    only updates the markers and draws them on top of the restored buffer.
+    '''
+    def __init__(self, image_file="gpx/empty_moonboard_2016.png",
+                 holdset=DEFAULT_HOLDSET):
+        holdset = HOLDSETS[holdset]
+        self.holdset = holdset
+        self.fig, self.ax = new_fig(figsize=holdset.size)
+        self.ax.set_aspect('equal')
+        self.ax.imshow(board_image(image_file), extent=holdset.extent)
+        self.fig.tight_layout()
+        self.ax.axis('off')
+        self.fig.subplots_adjust(left=0.0, right=1.0, top=1.0, bottom=0.0)
+
+        # Marker collection, not part of the background
+        self.markers = problem_markers(self.ax, animated=True)
+
+        # Render board once, and keep the buffer
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def draw(self, artists):
+        '''
+        Restore background and draw artists on top
+        '''
+        self.fig.canvas.restore_region(self.background)
+        for artist in artists:
+            self.ax.draw_artist(artist)
+
+    def draw_holds(self, ids, is_start, is_end):
+        '''
+        Draw problem from hold ids, see 'hold_marker_data'
+
+        Holds which are not on the board of the holdset are not drawn
+        '''
+        valid = self.holdset.valid[ids]
+        self.draw_markers(*hold_marker_data(
+            ids[valid], is_start[valid], is_end[valid]))
+
+    def draw_markers(self, offsets, colors):
+        self.markers.set_offsets(offsets)
+        self.markers.set_edgecolors(colors)
+        self.draw([self.markers])
+
+    def save(self, filename, compress_level=1):
+        '''
+        Save current buffer as png
+
+        The board is opaque, so the alpha channel is dropped. Together with a
+        low compression level this makes encoding a lot faster, at about the
+        same file size as 'savefig'.
+        '''
+        from PIL import Image
+        buffer = np.asarray(self.fig.canvas.buffer_rgba())[..., :3]
+        Image.fromarray(buffer).save(
+            filename, format='png', compress_level=compress_level)
+
+
+def plot_frequency(holds_sum, holdset=DEFAULT_HOLDSET, color='red'):
+    '''
+    Plot hold usage as circles scaled by frequency, on board of holdset
+
+    Args:
+      holds_sum: array of counts per hold id, or dict[description, count]
+    '''
+    holdset = HOLDSETS[holdset]
+    fig, ax = new_fig(figsize=holdset.size)
     ax.set_aspect('equal')
-    img = plt.imread(image_file)
-    ax.imshow(img, extent=extent)
-    maximum = np.max(list(holds_sum_dict.values()))
-    scale = 4e+3/maximum
-    for description, value in holds_sum_dict.items():
-        coords = desc_to_coords(description)
-        if coords is not None:
-            ax.scatter(
-                coords[0], coords[1], s=scale*value, alpha=0.5,
-                color=color, edgecolors='black', linewidth=2)
+    img = board_image(holdset.image_file)
+    ax.imshow(img, extent=holdset.extent)
+
+    # Get hold ids and values of all used holds
+    if isinstance(holds_sum, dict):
+        indices = hold_ids(list(holds_sum.keys()))
+        values = np.array(list(holds_sum.values()))[indices >= 0]
+        indices = indices[indices >= 0]
+    else:
+        indices = np.flatnonzero(holds_sum)
+        values = np.asarray(holds_sum)[indices]
+    # Skip holds which are not on the board, e.g. above row 12 of the Mini
+    values = values[holdset.valid[indices]]
+    indices = indices[holdset.valid[indices]]
+    x, y = HOLD_COORDS[indices].T
+
+    scale = 4e+3/np.max(values)
+    ax.scatter(
+        x, y, s=scale*np.asarray(values), alpha=0.5,
+        color=color, edgecolors='black', linewidth=2)
 
     fig.tight_layout()
-    plt.axis('off')
+    ax.axis('off')
     fig.subplots_adjust(left=0.0, right=1.0, top=1.0, bottom=0.0)
     return fig, ax
 
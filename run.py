@@ -3,7 +3,12 @@ import argparse
 import os
 
 from datahandlers.data import DATAHANDLERS
-from utils.utils import StoreDict, Problem, LogbookEntry
+from utils.utils import StoreDict, LogbookEntry, LazyData
+from utils.store import ProblemStore, LogbookStore, LogbookJoin
+from utils.cache import load_problem_store
+from utils.holdsets import HOLDSETS
+from utils.similarity import SimilarityIndex
+from utils.profiling import Profiler
 
 
 def main():
@@ -22,18 +27,33 @@ def main():
         '--settings', type=str, nargs='+', action=StoreDict,
         help='Settings (e.g. overwrite:True)'
     )
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of independent datahandlers to run concurrently')
+    parser.add_argument(
+        '--profile', type=str, nargs='?', const='profile.json',
+        help='Write time, memory and figures per stage and datahandler to '
+        'json report (default profile.json). Datahandlers are run in order')
+    parser.add_argument(
+        '--profile-datahandler', type=str, choices=list(DATAHANDLERS.keys()),
+        help='Datahandler to also run with cProfile, when profiling')
+    parser.add_argument(
+        '--profile-no-memory', action='store_true',
+        help='Do not measure memory (tracemalloc) when profiling, which '
+        'otherwise slows down e.g. plotting')
 
     args, _ = parser.parse_known_args()
 
     filename = args.filename
-
-    # Load json data
-    with open(filename) as json_file:
-        problem_data = json.load(json_file)
+    profiler = Profiler(
+        enabled=args.profile is not None,
+        memory=not args.profile_no_memory,
+        cprofile_datahandler=args.profile_datahandler)
 
     # Load logbook
-    with open(args.logbook) as json_file:
-        logbook_data = json.load(json_file)
+    with profiler.stage('load logbook'):
+        with open(args.logbook) as json_file:
+            logbook_data = json.load(json_file)
 
     # Load settings, or set to empty dict
     settings = args.settings if args.settings is not None else {}
@@ -50,85 +70,137 @@ def main():
             general_kwargs[k] = v
 
     # Construct input data in 'accumulated_data' dict
-    # Place initial data here, to allow datahandlers to change data
-    accumulated_data = construct_data(problem_data, logbook_data)
+    # Place initial data here, to allow datahandlers to change data.
+    # Entries are computed lazily, when needed by some datahandler
+    with profiler.stage('construct_data'):
+        accumulated_data = construct_data(
+            logbook_data=logbook_data, problem_file=filename)
+
+    # Skip if no datahandlers
+    datahandlers = [d for d in args.datahandlers if d is not None]
+
+    if args.jobs > 1 and not profiler.enabled:
+        run_concurrent(
+            datahandlers, accumulated_data, save_dir, settings,
+            general_kwargs, jobs=args.jobs)
+        return
 
     # Create and run datahandlers
-    for datahandler in args.datahandlers:
-        # Skip if no datahandlers
-        if datahandler is None:
-            continue
-        datahandler_class = DATAHANDLERS[datahandler]
-        datahandler_obj = datahandler_class(save_dir)
-
-        # Extract possible settings kwargs from args.settings
-        kwargs = settings[datahandler] if datahandler in settings else {}
-        # Run datahandler object, with different inputs, and settings dict
-        returned_data = datahandler_obj(
-            **{**accumulated_data, **general_kwargs, **kwargs},
-        )
+    for datahandler in datahandlers:
+        # Computing (lazy) inputs, and running, are profiled separately
+        with profiler.stage('inputs', datahandler):
+            kwargs = datahandler_kwargs(
+                datahandler, accumulated_data, settings, general_kwargs)
+        with profiler.stage('run', datahandler, save_dir=save_dir):
+            returned_data = run_datahandler(datahandler, save_dir, kwargs)
         if returned_data:
-            accumulated_data = {**accumulated_data, **returned_data}
+            accumulated_data.update(returned_data)
+
+    profiler.save(args.profile)
+
+
+def datahandler_kwargs(datahandler, accumulated_data, settings,
+                       general_kwargs):
+    '''
+    Get kwargs for a datahandler: declared inputs, and general and specific
+    settings
+    '''
+    datahandler_class = DATAHANDLERS[datahandler]
+    # Extract possible settings kwargs from args.settings
+    kwargs = settings[datahandler] if datahandler in settings else {}
+    inputs = datahandler_class.select_inputs(accumulated_data)
+    return {**inputs, **general_kwargs, **kwargs}
+
+
+def run_datahandler(datahandler, save_dir, kwargs):
+    '''
+    Create and run datahandler object, return its returned data
+    '''
+    datahandler_obj = DATAHANDLERS[datahandler](save_dir)
+    return datahandler_obj(**kwargs)
+
+
+def schedule_datahandlers(datahandlers):
+    '''
+    Group datahandlers in stages, where datahandlers of a stage are
+    independent and can run concurrently
+
+    A datahandler depends on an earlier one if it consumes some of its
+    outputs. Datahandlers without declared inputs (consuming everything),
+    and repeated datahandlers, are run after everything before them.
+
+    Return:
+      list of stages, as lists of indices into datahandlers
+    '''
+    stage_of = []
+    for i, datahandler in enumerate(datahandlers):
+        inputs = DATAHANDLERS[datahandler].inputs
+        stage = 0
+        for j in range(i):
+            earlier = DATAHANDLERS[datahandlers[j]]
+            depends = (
+                inputs is None or earlier.inputs is None
+                or datahandlers[j] == datahandler
+                or set(earlier.outputs) & set(inputs))
+            if depends:
+                stage = max(stage, stage_of[j] + 1)
+        stage_of.append(stage)
+
+    stages = [[] for _ in range(max(stage_of, default=-1) + 1)]
+    for i, stage in enumerate(stage_of):
+        stages[stage].append(i)
+    return stages
+
+
+def run_concurrent(datahandlers, accumulated_data, save_dir, settings,
+                   general_kwargs, jobs=2):
+    '''
+    Run independent datahandlers concurrently, in a process pool
+
+    Returned data is merged into accumulated_data after each stage, in the
+    order the datahandlers were given.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for stage in schedule_datahandlers(datahandlers):
+            # Compute inputs here, and run datahandlers in pool
+            futures = []
+            for i in stage:
+                kwargs = datahandler_kwargs(
+                    datahandlers[i], accumulated_data, settings,
+                    general_kwargs)
+                futures.append(executor.submit(
+                    run_datahandler, datahandlers[i], save_dir, kwargs))
+
+            # Merge in fixed order
+            for future in futures:
+                returned_data = future.result()
+                if returned_data:
+                    accumulated_data.update(returned_data)
 
 
 def get_benchmark_problems(
-        cache_folder='benchmark_problems',
+        cache_folder='problem_cache',
+        problem_folder='MoonBoard',
         day_limit=5,
 ):
-    holdset_name_list = [
-        'MoonBoard 2016 ',
-        'MoonBoard Masters 2017 25',
-        'MoonBoard Masters 2017 40',
-        'MoonBoard Masters 2019 25',
-        'MoonBoard Masters 2019 40',
-        'Mini MoonBoard 2020 40',
-        ]
-
-    # Make sure cache folder exists
-    import os
-    if not os.path.isdir(cache_folder):
-        os.makedirs(cache_folder)
-
     # Dict to hold lists of problems
     benchmark_problems_dict = {}
     benchmark_grades_dict = {}
 
     # Loop all holdsets
-    for holdset in holdset_name_list:
+    for holdset in HOLDSETS:
         filename = f'problems {holdset}.json'
 
-        # Load BM data from cache, or construct
-        cache_file = os.path.join(cache_folder, filename)
-        if os.path.exists(cache_file):
-            # Cache exists -> Load benchmark data
-            with open(cache_file) as json_file:
-                benchmark_data = json.load(json_file)
-        else:
-            # Don't exist -> Construct benchmark data
-            problem_file = os.path.join('MoonBoard', filename)
-            benchmark_data = []
-            with open(problem_file) as json_file:
-                problem_data = json.load(json_file)
-            for problem in problem_data['data']:
-                if problem['isBenchmark']:
-                    benchmark_data.append(problem)
-            json_object = json.dumps(benchmark_data, indent=4)
-            with open(cache_file, "w") as outfile:
-                outfile.write(json_object)
-
-        # Go through BM data and create list of Problem objects
-        problem_list = []
-        for problem_dict in benchmark_data:
-            problem_list.append(Problem(**problem_dict))
-        benchmark_problems_dict[holdset] = problem_list
+        # Load BM problem store from binary cache, (re)built if needed
+        problem_file = os.path.join(problem_folder, filename)
+        store = load_problem_store(
+            problem_file, cache_folder=cache_folder, benchmarks_only=True)
+        benchmark_problems_dict[holdset] = store.problem_list
 
         # Create 'list' of all bm grades for this holdset
         # (or actually a mapping from grades to int
-        grade_list = []
-        for bm in problem_list:
-            if bm.grade not in grade_list:
-                grade_list.append(bm.grade)
-        grade_list.sort()
+        grade_list = store.used_grades()
         # Make a mapping from str grade to int
         grade_int_mapping = {}
         for i, grade in enumerate(grade_list):
@@ -139,70 +211,121 @@ def get_benchmark_problems(
     return (benchmark_problems_dict, benchmark_grades_dict)
 
 
-def construct_data(problem_data=None, logbook_data=None):
+def construct_data(problem_data=None, logbook_data=None, problem_store=None,
+                   problem_file=None, reference_data=None):
     '''
     Construct useful data from loaded problems and logbook
 
+    The data is returned as a LazyData, where each entry is only computed
+    when first accessed, e.g. by a datahandler declaring it as input.
+
     Args:
       problem_data: loaded from json, (all problems)
       logbook_data: loaded from json
+      problem_store: ProblemStore of all problems, used if no problem_data
+      problem_file: problems json file, loaded (via cache) if no store given
+      reference_data: dict of already loaded data, from load_reference_data
+    '''
+    data = LazyData(logbook_data=logbook_data)
+
+    # Get problems for some holdset, if given
+    problem_dict_list = problem_data['data'] if problem_data else None
+    data.update({'problem_dict_list': problem_dict_list})
+    if problem_dict_list is not None:
+        data.add('problem_store',
+                 lambda d: ProblemStore.from_dicts(d['problem_dict_list']))
+    elif problem_store is None and problem_file is not None:
+        data.add('problem_store', lambda d: load_problem_store(problem_file))
+    else:
+        data.update({'problem_store': problem_store})
+
+    for keys, producer in DATA_PRODUCERS.items():
+        data.add(keys, producer)
+
+    # Already loaded data is used instead of producing it again
+    if reference_data is not None:
+        data.update(reference_data)
+
+    return data
+
+
+# Data which does not depend on logbook or problem set
+REFERENCE_KEYS = (
+    'benchmark_problems_dict', 'benchmark_grades_dict',
+    'benchmark_stores_dict')
+
+
+def load_reference_data():
+    '''
+    Load data not depending on logbook, to reuse with construct_data
+
+    Benchmark problems are kept as ProblemStore arrays, so that it is cheap
+    to keep in memory, and can be shared with forked processes.
     '''
+    data = construct_data()
+    return {key: data[key] for key in REFERENCE_KEYS}
+
+
+def _benchmark_problems(data):
     # Get benchmark problems for _all_ holdsets from (possibly) cached files
-    (benchmark_problems_dict, benchmark_grades_dict) = get_benchmark_problems()
+    return get_benchmark_problems()
+
 
-    # Construct list of LogbookEntry objects
+def _logbook_dict(data):
+    # Construct dict of LogbookEntry objects
     logbook_dict = {}
-    for log in logbook_data:
+    for log in data['logbook_data']:
         logbook_entry = LogbookEntry(**log)
         logbook_dict[logbook_entry.apiId] = logbook_entry
+    return logbook_dict
 
-    # Possibly get list of _all problems_ for some holdset
-    problem_dict_list = None
-    list_of_grades = None
-    list_of_bm_grades = None
-    problem_list = None
-    benchmark_list = None
-    if problem_data is not None:
-        # Get list of problem_dicts
-        problem_dict_list = problem_data['data']
-
-        # Construct list of Problem objects
-        problem_list = []
-        for problem_dict in problem_dict_list:
-            problem_list.append(Problem(**problem_dict))
-
-        # Construct 'list_of_grades'
-        list_of_grades = []
-        for problem in problem_dict_list:
-            grade = problem['grade']
-            if grade not in list_of_grades:
-                list_of_grades.append(grade)
-        list_of_grades.sort()
-
-        # Construct benchmark list
-        benchmark_list = [p for p in problem_list if p.isBenchmark]
-        list_of_bm_grades = []
-
-        # Construct 'list_of_bm_grades'
-        for bm in benchmark_list:
-            if bm.grade not in list_of_bm_grades:
-                list_of_bm_grades.append(bm.grade)
-        list_of_bm_grades.sort()
-
-    # Return dict of different lists
-    data = {
-        'problem_dict_list': problem_dict_list,
-        'list_of_grades': list_of_grades,
-        'list_of_bm_grades': list_of_bm_grades,
-        'problem_list': problem_list,
-        'benchmark_list': benchmark_list,
-        'logbook_data': logbook_data,
-        'logbook_dict': logbook_dict,
-        'benchmark_problems_dict': benchmark_problems_dict,
-        'benchmark_grades_dict': benchmark_grades_dict,
-    }
 
-    return data
+def _benchmark_logbook_dict(data):
+    # Join logbook with benchmarks of each holdset, sorted by entry date
+    return {
+        holdset: LogbookJoin(data['logbook_store'], store)
+        for holdset, store in data['benchmark_stores_dict'].items()}
+
+
+def _from_problem_store(function):
+    '''
+    Producer calling function(data) if there is a problem store, else None
+    '''
+    def producer(data):
+        if data['problem_store'] is None:
+            return None
+        return function(data)
+    return producer
+
+
+# Producers of the entries of 'construct_data', with data key(s) as key
+DATA_PRODUCERS = {
+    ('benchmark_problems_dict', 'benchmark_grades_dict'): _benchmark_problems,
+    'benchmark_stores_dict': lambda d: {
+        k: v.store for k, v in d['benchmark_problems_dict'].items()},
+    'logbook_dict': _logbook_dict,
+    # Columnar logbook, with entry dates parsed once
+    'logbook_store': lambda d: LogbookStore(d['logbook_dict']),
+    'benchmark_logbook_dict': _benchmark_logbook_dict,
+    # List view of Problem objects
+    'problem_list': _from_problem_store(
+        lambda d: d['problem_store'].problem_list),
+    # Join logbook with all problems, sorted by entry date
+    'problem_logbook': _from_problem_store(
+        lambda d: LogbookJoin(d['logbook_store'], d['problem_store'])),
+    'list_of_grades': _from_problem_store(
+        lambda d: d['problem_store'].used_grades()),
+    # Benchmark store, list and grades
+    'benchmark_store': _from_problem_store(
+        lambda d: d['problem_store'].benchmarks()),
+    'benchmark_list': _from_problem_store(
+        lambda d: d['benchmark_store'].problem_list),
+    'list_of_bm_grades': _from_problem_store(
+        lambda d: d['benchmark_store'].used_grades()),
+    # Index for finding problems with similar holds
+    'similarity_index': _from_problem_store(
+        lambda d: SimilarityIndex(d['problem_store'])),
+}
 
 
 if __name__ == '__main__':
@@ -1,17 +1,57 @@
-import sys
 import os
-import json
-import base64
-import io
+import glob
+import threading
+import gc
+import hmac
+import hashlib
+import datetime
 
-from flask import Flask, render_template, request
-from run import construct_data
+from flask import (
+    Flask, render_template, request, redirect, url_for, jsonify, send_file)
+from run import construct_data, load_reference_data
 from datahandlers.data import DATAHANDLERS
 from utils.html import frame, image, h2, h4
+from utils.jobs import JobQueue
+from utils.logbook_sync import LogbookSync, file_fetch
+from utils.output_cache import content_hash
+from utils.image_store import ImageStore
+from utils.metrics import Metrics
+from utils.holdsets import HOLDSETS, DEFAULT_HOLDSET
+from utils.similarity import SimilarityIndex
+from utils.cache import load_problem_store
 
 
 app = Flask(__name__)
 
+# Benchmark problems and grades, loaded once. uwsgi imports the app in the
+# master process, and the workers then share it copy-on-write
+reference_data = None
+reference_lock = threading.Lock()
+
+
+def get_reference_data():
+    '''
+    Reference data, loading it if not loaded yet
+
+    Raises the error of loading, e.g. if a problems file is missing
+    '''
+    global reference_data
+    with reference_lock:
+        if reference_data is None:
+            reference_data = load_reference_data()
+            # Freeze gc, to not have it write to (and copy) the objects in
+            # workers
+            gc.freeze()
+        return reference_data
+
+
+# Load at import, but only fail the logbook pages (which retry) if the
+# problems can't be loaded
+try:
+    get_reference_data()
+except Exception as e:
+    print(f"Failed to load reference data: {e!r}")
+
 
 @app.route('/')
 @app.route('/form')
@@ -29,6 +69,55 @@ def example2():
     return render_template('example2.html')
 
 
+# Timings of phases of jobs, queue depth and cache hits, served on
+# /metrics. Shared between uwsgi workers through files in folder
+metrics = Metrics(folder='user_cache/metrics', descriptions={
+    'phase_seconds': 'Time of phases of jobs, per datahandler',
+    'job_seconds': 'Time running jobs',
+    'job_wait_seconds': 'Time jobs wait in the queue',
+    'jobs': 'Number of unfinished jobs',
+    'jobs_total': 'Number of finished jobs',
+    'cache_requests_total': 'Lookups of cached pages and series',
+    'image_requests_total': 'Requests of images, by response status',
+    'similar_seconds': 'Time of similar problem queries',
+    })
+# Pool running the logbook download and plotting, outside of the requests
+jobs = JobQueue(workers=2, folder='user_cache/jobs', metrics=metrics)
+# Stored logbooks of users. A local logbook file can be used instead of
+# the MoonBoard api by setting LOGBOOK_STUB=<filename>
+if os.environ.get('LOGBOOK_STUB'):
+    logbooks = LogbookSync(fetch=file_fetch(os.environ['LOGBOOK_STUB']))
+else:
+    logbooks = LogbookSync()
+# Datahandlers shown on the page
+PAGE_DATAHANDLERS = [
+    'BenchmarkProgress', 'BenchmarkProgressPerGrade',
+    'Times',
+]
+# Rendered figures, served from /images
+images = ImageStore('user_cache/images')
+# matplotlib is not thread safe, so let one job at a time do plotting
+plot_lock = threading.Lock()
+
+
+# Suffix of keys of series jobs, which have json results instead of a page
+SERIES_SUFFIX = '/series'
+
+# Secret of job keys. Made at import, i.e. shared by the uwsgi workers
+job_key_secret = os.urandom(32)
+
+
+def job_key(username, password):
+    '''
+    Key of the jobs of a user, from username and password
+
+    A keyed hash, so that job files don't contain a plain hash of passwords
+    '''
+    # Length prefixed, so that e.g. ('ab', 'c') and ('a', 'bc') differ
+    credentials = f'{len(username)}:{username}{password}'.encode()
+    return hmac.new(job_key_secret, credentials, hashlib.sha256).hexdigest()
+
+
 @app.route('/data/', methods=['POST', 'GET'])
 def data():
     if request.method == 'GET':
@@ -36,75 +125,316 @@ def data():
     if request.method == 'POST':
         form_data = request.form
 
-        sys.path.append("MoonBoard")
-        from MoonBoard.fetch_logbook import request_data
-
         # Get username and password
         username = form_data['username']
         password = form_data['password']
-        # Define cache filename
-        filename = f"logbook_{username}.json"
 
-        # Download logbook, or fetch cached
-        print(f"filename:{filename}")
-        print(f"os.path.isfile(filename):{os.path.isfile(filename)}")
-        # Download data and save
         try:
-            logbook_data = request_data(access_kwargs={
-                'username': username,
-                'password': password})
-        except KeyError:
-            from utils.html import get_wrong_password_string
-            html = h2(get_wrong_password_string())
-            html += "Your probably entered the wrong username or password"
+            get_reference_data()
+        except Exception as e:
+            print(f"Failed to load reference data: {e!r}")
+            return h2(
+                "Could not load the MoonBoard problems, try again later"), 503
+
+        # Only share jobs of same username and password
+        key = job_key(username, password)
+
+        if form_data.get('render') == 'browser':
+            # Only get data, and draw plots in the browser
+            job = jobs.submit(
+                f'{key}{SERIES_SUFFIX}', logbook_series, username, password)
+            return redirect(url_for('series_page', job_id=job.id), code=303)
+
+        # Start job, or join the unfinished job of the same user
+        job = jobs.submit(key, logbook_page, username, password)
+
+        return redirect(url_for('job_result', job_id=job.id), code=303)
+
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'id': job_id, 'status': 'unknown'}), 404
+    return jsonify(job.as_dict())
+
+
+@app.route('/jobs/<job_id>/series')
+def job_series(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'id': job_id, 'status': 'unknown'}), 404
+    if job.status == 'failed':
+        print(f"job.error:{job.error}")
+        return jsonify(job.as_dict()), 500
+    if job.status != 'done':
+        return jsonify(job.as_dict()), 202
+    return jsonify(job.result)
+
+
+@app.route('/series/<job_id>')
+def series_page(job_id):
+    return render_template('series.html', job_id=job_id)
+
+
+@app.route('/jobs/<job_id>')
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None or job.key.endswith(SERIES_SUFFIX):
+        # Series jobs are shown on /series
+        return h2("Unknown job, try submitting the form again"), 404
+    if job.status == 'failed':
+        print(f"job.error:{job.error}")
+        return h2("Something went wrong, try submitting the form again"), 500
+
+    # Stream page, with the parts of the job as they are done
+    header = render_template('page_header.html')
+
+    def page():
+        yield header
+        yield from jobs.stream(job_id)
+        # Job can be dropped while streaming, then show as failed
+        job = jobs.get(job_id)
+        if job is None or job.status == 'failed':
+            yield h2("Something went wrong, try submitting the form again")
+
+    # Ask nginx e.g. not to buffer the response
+    return app.response_class(
+        page(), mimetype='text/html', headers={'X-Accel-Buffering': 'no'})
+
+
+@app.route('/images/<digest>.png')
+def stored_image(digest):
+    path = images.path(digest)
+    if path is None:
+        return "Unknown image", 404
+    # Content never changes for a digest, so can be cached 'forever'
+    response = send_file(
+        path, mimetype='image/png', etag=digest, max_age=31536000,
+        conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    # 304 if browser has it cached
+    metrics.inc('image_requests_total', status=response.status_code)
+    # Not written on every request, jobs and /metrics also save
+    metrics.save(min_interval=60)
+    return response
+
+
+@app.route('/metrics')
+def metrics_page():
+    return app.response_class(
+        metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
-            return html
+# Similarity indexes of all problems, with holdset as key, built on first
+# request of each holdset
+similarity_indexes = {}
+similarity_lock = threading.Lock()
 
-        with open(filename, 'w') as json_file:
-            json.dump(logbook_data, json_file, indent=4)
 
+def similarity_index(holdset):
+    with similarity_lock:
+        if holdset not in similarity_indexes:
+            store = load_problem_store(
+                os.path.join('MoonBoard', f'problems {holdset}.json'))
+            similarity_indexes[holdset] = SimilarityIndex(store)
+        return similarity_indexes[holdset]
+
+
+@app.route('/similar')
+def similar():
+    '''
+    Problems with most similar holds, as json
+
+    Query arguments are 'holdset' (default 2016), and 'api_id' or 'holds'
+    (comma separated, e.g. E6,G8,D18), and optional 'grades' (comma
+    separated) and 'k' (number of problems, at most 100)
+    '''
+    holdset = request.args.get('holdset', DEFAULT_HOLDSET)
+    if holdset not in HOLDSETS:
+        return jsonify({'error': f'Unknown holdset {holdset}'}), 404
+    try:
+        api_id = request.args.get('api_id', type=int)
+        k = min(max(request.args.get('k', 10, type=int), 1), 100)
+        holds = request.args.get('holds')
+        holds = holds.split(',') if holds else None
+        grades = request.args.get('grades')
+        grades = grades.split(',') if grades else None
+
+        try:
+            index = similarity_index(holdset)
+        except OSError:
+            return jsonify({'error': f'No problems of {holdset}'}), 404
+        with metrics.time('similar_seconds'):
+            problems = index.query(
+                api_id=api_id, holds=holds, k=k, grades=grades)
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'holdset': holdset, 'problems': problems})
+
+
+def phase(name, datahandler=''):
+    '''
+    Context manager, recording time of phase of job in metrics
+    '''
+    return metrics.time('phase_seconds', phase=name, datahandler=datahandler)
+
+
+def record_cache(name, result):
+    metrics.inc(
+        'cache_requests_total', cache=name,
+        result='miss' if result is None else 'hit')
+
+
+def logbook_page(username, password):
+    '''
+    Sync logbook of user, and generate html page with plots
+
+    The page is generated in parts, to be streamed as they are done
+    '''
+    # Fetch new logbook entries, and merge with stored
+    try:
+        with phase('fetch'):
+            logbook_data, logbook_hash = logbooks.sync(username, password)
+    except KeyError:
+        from utils.html import get_wrong_password_string
+        html = h2(get_wrong_password_string())
+        html += "Your probably entered the wrong username or password"
+
+        yield html
+        return
+
+    datahandlers = PAGE_DATAHANDLERS
+
+    # Use cached page if same logbook, problems and code, and made today
+    key = result_key(logbook_hash, datahandlers)
+    html = logbooks.cached(username, key)
+    record_cache('page', html)
+    if html is not None:
+        yield html
+        return
+
+    with phase('construct_data'):
         data_dict = construct_data(
-            logbook_data=logbook_data, problem_data=None)
-
-        datahandlers = [
-            'BenchmarkProgress', 'BenchmarkProgressPerGrade',
-            'Times',
-        ]
-        settings = {}
-        general_kwargs = {'save': False}
-        from utils.html import parse_docstring
-
-        html = ""
-        for datahandler in datahandlers:
-            datahandler_class = DATAHANDLERS[datahandler]
-            datahandler_obj = datahandler_class()
-
-            # Extract possible settings kwargs from args.settings
-            kwargs = settings[datahandler] if datahandler in settings else {}
-            # Run datahandler object, with different inputs, and settings dict
-            datahandler_output = datahandler_obj(
-                **{**data_dict, **general_kwargs, **kwargs})
+            logbook_data=logbook_data, problem_data=None,
+            reference_data=get_reference_data())
+
+    settings = {}
+    general_kwargs = {'save': False}
+    from utils.html import parse_docstring
 
+    parts = []
+    for datahandler in datahandlers:
+        datahandler_class = DATAHANDLERS[datahandler]
+        datahandler_obj = datahandler_class()
+
+        # Extract possible settings kwargs from args.settings
+        kwargs = settings[datahandler] if datahandler in settings else {}
+        # Get declared inputs, computing them if needed
+        with phase('compute', datahandler):
+            inputs = datahandler_obj.select_inputs(data_dict)
+
+        with phase('html', datahandler):
             docstr = parse_docstring(datahandler_obj)
 
-            html += h2(datahandler)
-            html += docstr
+        # Show heading and description before plotting
+        parts.append(h2(datahandler) + docstr)
+        yield parts[-1]
+
+        with phase('plot_lock', datahandler):
+            plot_lock.acquire()
+        try:
+            # Run datahandler object, with its declared inputs, and settings
+            with phase('plot', datahandler):
+                datahandler_output = datahandler_obj(
+                    **{**inputs, **general_kwargs, **kwargs})
 
             if type(datahandler_output) == tuple:
-                fig, ax = datahandler_output
-                output = io.BytesIO()
-                fig.savefig(output, format='png', bbox_inches="tight")
-                data = base64.b64encode(output.getbuffer()).decode("ascii")
-                html += frame(image(data))
-            elif type(datahandler_output) == dict:
-                for name, (fig, ax) in datahandler_output.items():
-                    output = io.BytesIO()
-                    fig.savefig(output, format='png', bbox_inches="tight")
-                    data = base64.b64encode(output.getbuffer()).decode("ascii")
-                    html += h4(name)
-                    html += frame(image(data))
-
-        return html
+                datahandler_output = {None: datahandler_output}
+            for name, (fig, ax) in datahandler_output.items():
+                with phase('png', datahandler):
+                    url = figure_url(fig)
+                with phase('html', datahandler):
+                    part = frame(image(url))
+                    if name is not None:
+                        part = h4(name) + part
+                parts.append(part)
+                yield part
+        finally:
+            plot_lock.release()
+
+    with phase('store'):
+        logbooks.store(username, key, ''.join(parts))
+
+
+def logbook_series(username, password):
+    '''
+    Sync logbook of user, and return json series of the page datahandlers
+
+    Return:
+      dict with list of datahandlers with name, doc and series, or with
+      message if wrong username or password
+    '''
+    try:
+        with phase('fetch'):
+            logbook_data, logbook_hash = logbooks.sync(username, password)
+    except KeyError:
+        from utils.html import get_wrong_password_string
+        return {'message': get_wrong_password_string()}
+
+    datahandlers = PAGE_DATAHANDLERS
+    key = result_key(logbook_hash, datahandlers)
+    result = logbooks.cached(username, key, name='series')
+    record_cache('series', result)
+    if result is not None:
+        return result
+
+    with phase('construct_data'):
+        data_dict = construct_data(
+            logbook_data=logbook_data, problem_data=None,
+            reference_data=get_reference_data())
+
+    from utils.html import parse_docstring
+    result = {'datahandlers': []}
+    for datahandler in datahandlers:
+        datahandler_obj = DATAHANDLERS[datahandler]()
+        with phase('compute', datahandler):
+            inputs = datahandler_obj.select_inputs(data_dict)
+        with phase('series', datahandler):
+            series = datahandler_obj(**inputs, save=False, series=True)
+        result['datahandlers'].append({
+            'name': datahandler,
+            'doc': parse_docstring(datahandler_obj),
+            'series': series})
+
+    with phase('store'):
+        logbooks.store(username, key, result, name='series')
+    return result
+
+
+def result_key(logbook_hash, datahandlers):
+    '''
+    Key of cached results, from logbook, problems, code and date
+    '''
+    today = datetime.date.today().isoformat()
+    problem_files = [
+        (f, os.stat(f).st_size, os.stat(f).st_mtime_ns)
+        for f in sorted(glob.glob('MoonBoard/problems *.json'))]
+    return content_hash(
+        logbook_hash, today, problem_files,
+        [DATAHANDLERS[d].code_version() for d in datahandlers])
+
+
+def figure_url(fig):
+    '''
+    Store figure as png in image store, and return url
+    '''
+    digest = images.save_figure(fig, bbox_inches="tight")
+    # Jobs run outside of requests, so can't use url_for
+    return f"/images/{digest}.png"
 
 
 if __name__ == '__main__':
@@ -1,4 +1,7 @@
 #!/bin/bash
 
 # Setup from https://gist.github.com/mplewis/6076082
-uwsgi --socket 127.0.0.1:4242 --plugins python --module run_flask --callab app
+# The app is loaded in the master, and reference data is shared with the
+# forked workers. Jobs are shared between workers via 'user_cache/jobs'
+uwsgi --socket 127.0.0.1:4242 --plugins python --module run_flask --callab app \
+    --master --processes 4 --threads 4 --enable-threads
@@ -0,0 +1,106 @@
+import os
+import hashlib
+
+from utils.store import ProblemStore
+from utils.stream import iter_json_array
+
+
+# Bump when the layout of the cached stores change
+CACHE_VERSION = 1
+
+
+def file_hash(filename, chunk_size=1 << 20):
+    '''
+    sha1 hex digest of file content
+    '''
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _cache_is_valid(meta, problem_file):
+    '''
+    Check if cache meta data matches the source file
+
+    Size and mtime are checked first, and the (slower) content hash is only
+    computed if the mtime has changed, e.g. after a re-fetch of same data.
+    '''
+    if meta.get('version') != CACHE_VERSION:
+        return False
+    if not os.path.exists(problem_file):
+        # Nothing to compare with, so trust the cache
+        return True
+
+    stat = os.stat(problem_file)
+    if meta.get('source_size') != stat.st_size:
+        return False
+    if meta.get('source_mtime') == stat.st_mtime_ns:
+        return True
+    return meta.get('source_hash') == file_hash(problem_file)
+
+
+def _read_problems(problem_file, benchmarks_only):
+    # Stream problems from file, to not hold the full json tree in memory
+    problem_dicts = iter_json_array(problem_file, key='data')
+    if benchmarks_only:
+        problem_dicts = (p for p in problem_dicts if p['isBenchmark'])
+    return ProblemStore.from_dicts(problem_dicts)
+
+
+def load_problem_store(
+        problem_file,
+        cache_folder='problem_cache',
+        benchmarks_only=False,
+):
+    '''
+    Load ProblemStore for a problems json file, via binary cache
+
+    The cache is rebuilt if the source file has changed since it was written.
+
+    Args:
+      problem_file: path to problems json, e.g. 'problems MoonBoard 2016 .json'
+      cache_folder: folder where to keep the .npz cache files
+      benchmarks_only: only keep benchmark problems
+    '''
+    # Make sure cache folder exists
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+
+    name = os.path.splitext(os.path.basename(problem_file))[0]
+    if benchmarks_only:
+        name += '.benchmarks'
+    cache_file = os.path.join(cache_folder, f'{name}.npz')
+
+    # Load from cache if valid
+    if os.path.exists(cache_file):
+        try:
+            store, meta = ProblemStore.load(cache_file)
+        except (OSError, ValueError, KeyError):
+            # Broken or old cache file, rebuild below
+            pass
+        else:
+            if _cache_is_valid(meta, problem_file):
+                mtime = (os.stat(problem_file).st_mtime_ns
+                         if os.path.exists(problem_file) else None)
+                if mtime is not None and meta.get('source_mtime') != mtime:
+                    # Same content with a new mtime, e.g. re-fetched. Store
+                    # the new mtime, to not hash the file on every load
+                    meta['source_mtime'] = mtime
+                    store.save(cache_file, **meta)
+                return store
+
+    # Construct store, and save together with info about source
+    stat = os.stat(problem_file)
+    source_hash = file_hash(problem_file)
+    store = _read_problems(problem_file, benchmarks_only)
+    store.save(
+        cache_file,
+        version=CACHE_VERSION,
+        source_size=stat.st_size,
+        source_mtime=stat.st_mtime_ns,
+        source_hash=source_hash,
+    )
+
+    return store
@@ -0,0 +1,71 @@
+import numpy as np
+
+
+# Board layout shared by all holdsets. Columns A-K, rows 1-18 (the Mini
+# board only uses the 12 lowest rows)
+COLUMN_LETTERS = 'ABCDEFGHIJK'
+NUM_COLUMNS = len(COLUMN_LETTERS)
+NUM_ROWS = 18
+NUM_HOLDS = NUM_COLUMNS * NUM_ROWS
+
+# Registry of all holds, with a dense integer id per hold. The id is
+# row * NUM_COLUMNS + column, e.g. E6 -> 5*11 + 4 = 59
+HOLD_DESCRIPTIONS = np.array([
+    f'{COLUMN_LETTERS[column]}{row+1}'
+    for row in range(NUM_ROWS) for column in range(NUM_COLUMNS)])
+HOLD_IDS = {description: i for i, description in enumerate(HOLD_DESCRIPTIONS)}
+# Board coordinates (column, row) of each hold id, starting from (0, 0)
+HOLD_COORDS = np.stack(np.divmod(np.arange(NUM_HOLDS), NUM_COLUMNS)[::-1],
+                       axis=1).astype(float)
+
+
+class Holdset():
+    '''
+    Geometry of the board of a holdset
+
+    Args:
+      name: name of holdset, as in the problem file names
+      num_rows: number of rows of the board
+      size: figure size to plot the board in
+      extent: extent of board image, in hold coordinates
+    '''
+    def __init__(self, name, num_rows, size, extent):
+        self.name = name
+        self.num_rows = num_rows
+        self.size = size
+        self.extent = extent
+        self.image_file = f'gpx/{name}.png'
+        # Bool mask of hold ids on this board
+        self.valid = np.arange(NUM_HOLDS) < num_rows * NUM_COLUMNS
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r})'
+
+
+# Full size and Mini board geometry
+_BOARD_SIZE = (8.82, 13.56)
+_BOARD_EXTENT = (-1.9, 10+1.14, -1.28, 17+1.77)
+_MINI_SIZE = (8.82, 9.42)
+_MINI_EXTENT = (-1.9, 10+1.10, -1.28, 11+1.65)
+
+HOLDSETS = {holdset.name: holdset for holdset in [
+    Holdset('MoonBoard 2016 ', 18, _BOARD_SIZE, _BOARD_EXTENT),
+    Holdset('MoonBoard Masters 2017 25', 18, _BOARD_SIZE, _BOARD_EXTENT),
+    Holdset('MoonBoard Masters 2017 40', 18, _BOARD_SIZE, _BOARD_EXTENT),
+    Holdset('MoonBoard Masters 2019 25', 18, _BOARD_SIZE, _BOARD_EXTENT),
+    Holdset('MoonBoard Masters 2019 40', 18, _BOARD_SIZE, _BOARD_EXTENT),
+    Holdset('Mini MoonBoard 2020 40', 12, _MINI_SIZE, _MINI_EXTENT),
+]}
+DEFAULT_HOLDSET = 'MoonBoard 2016 '
+
+
+def hold_ids(descriptions):
+    '''
+    Hold ids of an array of descriptions, -1 for invalid descriptions
+
+    Each distinct description is only looked up once.
+    '''
+    descriptions = np.asarray(descriptions, dtype=str)
+    unique, inverse = np.unique(descriptions, return_inverse=True)
+    lookup = np.array([HOLD_IDS.get(d, -1) for d in unique], dtype=np.intp)
+    return lookup[inverse].reshape(descriptions.shape)
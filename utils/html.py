@@ -5,8 +5,8 @@ def frame(string):
     return f'<div class=frame>{string}</div>'
 
 
-def image(string):
-    return f"<img src='data:image/png;base64,{string}'/>"
+def image(url):
+    return f"<img src='{url}'/>"
 
 
 def h2(string):
@@ -0,0 +1,92 @@
+import os
+import io
+import time
+import hashlib
+
+
+class ImageStore():
+    '''
+    Folder of png images, stored with the hash of their content as name
+
+    As the name changes with the content, images can be cached by browsers
+    without ever being revalidated, and equal images are only stored once.
+
+    Images not saved again for 'max_age' seconds are removed, checked at
+    most every 'cleanup_interval' seconds when saving. Cached pages are only
+    used the same day, so their images are kept as long as they are used.
+
+    Args:
+      folder: folder of images, relative to the working directory
+      max_age: seconds to keep images since last saved
+      cleanup_interval: seconds between removing old images
+    '''
+    def __init__(self, folder, max_age=7*24*3600, cleanup_interval=3600):
+        # Absolute, as e.g. flask's send_file resolves relative paths from
+        # the app folder, not the working directory
+        self.folder = os.path.abspath(folder)
+        self.max_age = max_age
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path(self, digest):
+        '''
+        Path of image with digest, or None if not a valid digest or missing
+        '''
+        if len(digest) != 40 or not all(
+                c in '0123456789abcdef' for c in digest):
+            return None
+        path = os.path.join(self.folder, f'{digest}.png')
+        if not os.path.isfile(path):
+            return None
+        return path
+
+    def save_figure(self, fig, **kwargs):
+        '''
+        Save figure as png, and return its digest
+
+        Figures of plots.plot.new_fig are not kept by pyplot, so need no
+        closing
+        '''
+        output = io.BytesIO()
+        fig.savefig(output, format='png', **kwargs)
+        return self.save(output.getbuffer())
+
+    def save(self, png):
+        '''
+        Store png bytes, and return digest
+        '''
+        digest = hashlib.sha1(png).hexdigest()
+        path = os.path.join(self.folder, f'{digest}.png')
+        if os.path.isfile(path):
+            # Mark as used, to not be removed
+            os.utime(path)
+        else:
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as png_file:
+                png_file.write(png)
+            os.replace(tmp_path, path)
+
+        if time.time() - self.last_cleanup > self.cleanup_interval:
+            self.cleanup()
+        return digest
+
+    def cleanup(self):
+        '''
+        Remove images not saved for max_age seconds
+
+        Return:
+          number of removed images
+        '''
+        self.last_cleanup = time.time()
+        removed = 0
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if self.last_cleanup - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                # E.g. removed by other process
+                pass
+        return removed
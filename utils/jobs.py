@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.output_cache import file_lock
+
+
+def pid_is_running(pid):
+    '''
+    Check if process with pid is running
+    '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job():
+    '''
+    A job in the job queue, with status and result
+
+    Status is one of 'queued', 'running', 'done' and 'failed'
+    '''
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.result = None
+        self.parts = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def as_dict(self):
+        job_dict = {'id': self.id, 'status': self.status}
+        if self.error is not None:
+            job_dict['error'] = self.error
+        return job_dict
+
+    @classmethod
+    def from_file(cls, filename):
+        '''
+        Read job written by JobQueue, or None if no (valid) file
+        '''
+        try:
+            with open(filename) as json_file:
+                job_dict = json.load(json_file)
+        except (OSError, ValueError):
+            return None
+        job = cls(job_dict['key'])
+        job.__dict__.update(job_dict)
+        return job
+
+
+class JobQueue():
+    '''
+    Run jobs in a local pool of worker threads
+
+    Jobs submitted with the same key while one is still queued or running
+    share that job, e.g. several requests for the same user. Finished jobs
+    are kept for 'keep' seconds, so the result can be fetched.
+
+    A job function can also be a generator of str parts. The parts are then
+    available in 'job.parts' as they are done, e.g. to stream them using
+    'stream', and the result is the joined parts.
+
+    If a folder is given, jobs are also written there, so that other
+    processes (e.g. uwsgi workers) can get status and result. The unfinished
+    job of each key is then also recorded there, so jobs with the same key
+    are shared between the processes too.
+
+    If metrics (utils.metrics.Metrics) are given, the number of queued and
+    running jobs, and the time waiting in the queue and running, per job
+    function, are recorded.
+
+    Args:
+      workers: number of worker threads
+      keep: seconds to keep finished jobs
+      folder: folder to write jobs to
+      metrics: metrics to record queue depth and job times in
+    '''
+    def __init__(self, workers=2, keep=600, folder=None, metrics=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.keep = keep
+        self.folder = folder
+        self.metrics = metrics
+        if folder is not None:
+            os.makedirs(os.path.join(folder, 'active'), exist_ok=True)
+        self.jobs = {}
+        # Unfinished jobs, with key as key
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, function, *args, **kwargs):
+        '''
+        Submit function to run as a job, unless a job with key is unfinished
+
+        Return:
+          job
+        '''
+        with self.lock:
+            self._drop_old()
+            if key in self.active:
+                return self.active[key]
+            job = Job(key)
+            other = self._claim(job)
+            if other is not None:
+                # Unfinished job of other process
+                return other
+            self.jobs[job.id] = job
+            self.active[key] = job
+        self._write(job)
+        self._record_depth()
+        self.executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        '''
+        Get job from id, or None if unknown (or dropped)
+        '''
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.folder is not None:
+            # Possibly job of other process
+            job = Job.from_file(self._filename(job_id))
+        return job
+
+    def stream(self, job_id, poll=0.1):
+        '''
+        Generate parts of job, waiting for new until job is finished
+        '''
+        sent = 0
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            # Check before sending, to not miss parts done in between
+            is_finished = job.is_finished
+            while sent < len(job.parts):
+                yield job.parts[sent]
+                sent += 1
+            if is_finished:
+                if not job.parts and job.result is not None:
+                    # Not a generator job
+                    yield job.result
+                return
+            time.sleep(poll)
+
+    def queued(self):
+        '''
+        Number of unfinished jobs
+        '''
+        with self.lock:
+            return len(self.active)
+
+    def _run(self, job, function, args, kwargs):
+        job.status = 'running'
+        started = time.time()
+        self._write(job)
+        self._record_depth()
+        try:
+            result = function(*args, **kwargs)
+            if inspect.isgenerator(result):
+                for part in result:
+                    job.parts.append(part)
+                    self._write(job)
+                result = ''.join(job.parts)
+            job.result = result
+            job.status = 'done'
+        except Exception as e:
+            job.error = f'{type(e).__name__}: {e}'
+            job.status = 'failed'
+        job.finished = time.time()
+        self._write(job)
+        with self.lock:
+            if self.active.get(job.key) is job:
+                del self.active[job.key]
+        self._release(job)
+        if self.metrics is not None:
+            name = function.__name__
+            self.metrics.observe(
+                'job_wait_seconds', started - job.created, function=name)
+            self.metrics.observe(
+                'job_seconds', job.finished - started, function=name)
+            self.metrics.inc('jobs_total', function=name, status=job.status)
+            self._record_depth()
+
+    def _record_depth(self):
+        '''
+        Record number of queued and running jobs, and save metrics
+        '''
+        if self.metrics is None:
+            return
+        with self.lock:
+            statuses = [job.status for job in self.active.values()]
+        for status in ('queued', 'running'):
+            self.metrics.set('jobs', statuses.count(status), status=status)
+        self.metrics.save()
+
+    @property
+    def _active_lock(self):
+        # One lock of all keys, held only while checking or updating
+        return os.path.join(self.folder, 'active', 'lock')
+
+    def _active_filename(self, key):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.folder, 'active', f'{name}.json')
+
+    def _claim(self, job):
+        '''
+        Record job as the unfinished job of its key in folder, unless some
+        other process has an unfinished job with the key
+
+        Return:
+          the job of other process, or None if claimed
+        '''
+        if self.folder is None:
+            return None
+        filename = self._active_filename(job.key)
+        with file_lock(self._active_lock):
+            other = None
+            try:
+                with open(filename) as json_file:
+                    active = json.load(json_file)
+            except (OSError, ValueError):
+                pass
+            else:
+                other = Job.from_file(self._filename(active['id']))
+                # Skip finished jobs, and jobs of processes no longer running
+                if other is not None and (
+                        other.is_finished or not pid_is_running(active['pid'])):
+                    other = None
+            if other is None:
+                with open(filename, 'w') as json_file:
+                    json.dump({'id': job.id, 'pid': os.getpid()}, json_file)
+        return other
+
+    def _release(self, job):
+        # Remove record of job as the unfinished job of its key
+        if self.folder is None:
+            return
+        filename = self._active_filename(job.key)
+        with file_lock(self._active_lock):
+            try:
+                with open(filename) as json_file:
+                    active = json.load(json_file)
+                if active['id'] == job.id:
+                    os.remove(filename)
+            except (OSError, ValueError):
+                pass
+
+    def _filename(self, job_id):
+        # Only use hex ids in filenames
+        if not all(c in '0123456789abcdef' for c in job_id):
+            job_id = 'invalid'
+        return os.path.join(self.folder, f'{job_id}.json')
+
+    def _write(self, job):
+        if self.folder is None:
+            return
+        filename = self._filename(job.id)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as json_file:
+            json.dump(job.__dict__, json_file)
+        os.replace(tmp_filename, filename)
+
+    def _drop_old(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.is_finished and now - job.finished > self.keep:
+                del self.jobs[job_id]
+                if self.folder is not None:
+                    try:
+                        os.remove(self._filename(job_id))
+                    except OSError:
+                        pass
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import hashlib
+
+from utils.output_cache import content_hash
+
+
+def request_fetch(username, password, since):
+    '''
+    Fetch logbook entries from the MoonBoard api
+
+    The api only gives the full logbook, so 'since' is not used, and the
+    logbook is returned as complete.
+    '''
+    sys.path.append("MoonBoard")
+    from MoonBoard.fetch_logbook import request_data
+    logbook = request_data(access_kwargs={
+        'username': username,
+        'password': password})
+    return logbook, True
+
+
+def file_fetch(filename):
+    '''
+    Stub of the logbook api, giving the full logbook from local logbook file
+    '''
+    def fetch(username, password, since):
+        with open(filename) as json_file:
+            logbook = json.load(json_file)
+        return logbook, True
+    return fetch
+
+
+def _write_json(filename, data):
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(tmp_filename, filename)
+
+
+class LogbookSync():
+    '''
+    Per-user logbook store, synced incrementally
+
+    For each user the logbook is kept, together with the last entryDate
+    (the sync point) and a hash of the logbook. A complete fetch replaces
+    the stored logbook, so that entries deleted or edited on the MoonBoard
+    are also updated. An incremental fetch (of entries from the sync point
+    on) is merged with the stored logbook. Users are stored in a subfolder
+    named from a hash of the username.
+
+    Args:
+      folder: folder of user stores
+      fetch: function(username, password, since) returning (list of logbook
+        entries, complete), where complete is True if the list is the full
+        logbook, and otherwise the entries from 'since'. Raises KeyError on
+        wrong username or password
+    '''
+    def __init__(self, folder='user_cache', fetch=request_fetch):
+        self.folder = folder
+        self.fetch = fetch
+
+    def user_folder(self, username):
+        name = hashlib.sha1(username.encode()).hexdigest()
+        return os.path.join(self.folder, name)
+
+    def _read(self, username):
+        user_folder = self.user_folder(username)
+        try:
+            with open(os.path.join(user_folder, 'sync.json')) as json_file:
+                sync = json.load(json_file)
+            with open(os.path.join(user_folder, 'logbook.json')) as json_file:
+                logbook = json.load(json_file)
+        except (OSError, ValueError):
+            return {'since': None, 'hash': None}, []
+        return sync, logbook
+
+    def sync(self, username, password):
+        '''
+        Fetch entries of user, and update stored logbook
+
+        Return:
+          logbook (list of entries, sorted by entryDate), and hash of logbook
+        '''
+        sync, logbook = self._read(username)
+        new_logbook, complete = self.fetch(username, password, sync['since'])
+        if complete:
+            # Replace stored logbook, e.g. with removed entries
+            logbook = []
+
+        # Merge, with one entry per problem (as in 'logbook_dict')
+        merged = {log['problem']['apiId']: log for log in logbook}
+        for log in new_logbook:
+            merged[log['problem']['apiId']] = log
+        logbook = sorted(merged.values(), key=lambda log: log['entryDate'])
+
+        logbook_hash = content_hash(
+            json.dumps(logbook, sort_keys=True).encode())
+        if logbook_hash != sync['hash']:
+            user_folder = self.user_folder(username)
+            os.makedirs(user_folder, exist_ok=True)
+            _write_json(os.path.join(user_folder, 'logbook.json'), logbook)
+            since = logbook[-1]['entryDate'] if logbook else None
+            _write_json(
+                os.path.join(user_folder, 'sync.json'),
+                {'since': since, 'hash': logbook_hash})
+
+        return logbook, logbook_hash
+
+    def cached(self, username, key, name='result'):
+        '''
+        Get cached result (of name) of user with key, or None
+        '''
+        filename = os.path.join(self.user_folder(username), f'{name}.json')
+        try:
+            with open(filename) as json_file:
+                result = json.load(json_file)
+        except (OSError, ValueError):
+            return None
+        if result['key'] != key:
+            return None
+        return result['value']
+
+    def store(self, username, key, value, name='result'):
+        '''
+        Cache json-serializable result (of name) of user with key
+        '''
+        user_folder = self.user_folder(username)
+        os.makedirs(user_folder, exist_ok=True)
+        _write_json(
+            os.path.join(user_folder, f'{name}.json'),
+            {'key': key, 'value': value})
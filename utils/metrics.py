@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+from utils.jobs import pid_is_running
+
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+def _labels_text(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    return f'{{{text}}}'
+
+
+class Metrics():
+    '''
+    Counters, gauges and histograms, exposed in Prometheus text format
+
+    Each process writes its metrics to a file in 'folder' (if given), and
+    'render' combines the metrics of all processes, e.g. of uwsgi workers.
+    Counters and histograms of finished processes are kept, while gauges
+    are only included for running processes.
+
+    Args:
+      prefix: prefix of metric names
+      folder: folder to share metrics between processes
+      descriptions: dict of metric name (without prefix) to help text
+    '''
+    def __init__(self, prefix='moonplt', folder=None, descriptions=None):
+        self.prefix = prefix
+        self.folder = folder
+        self.descriptions = descriptions or {}
+        self.lock = threading.Lock()
+        # Values, as dict[name, dict[labels_key, value]]
+        self.counters = {}
+        self.gauges = {}
+        # Histograms, with bucket counts followed by sum and count
+        self.histograms = {}
+        # Time of last save, see 'save'
+        self.last_save = float("-inf")
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            key = _labels_key(labels)
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_labels_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            values = self.histograms.setdefault(name, {})
+            key = _labels_key(labels)
+            if key not in values:
+                values[key] = [0] * (len(BUCKETS) + 2)
+            histogram = values[key]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        '''
+        Observe time of 'with' block, in seconds
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _filename(self, pid):
+        return os.path.join(self.folder, f'{pid}.json')
+
+    def save(self, min_interval=0):
+        '''
+        Write metrics of this process to folder
+
+        Args:
+          min_interval: only write if the last save is at least this many
+            seconds ago, e.g. for metrics of frequent requests
+        '''
+        if self.folder is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_save < min_interval:
+                return
+            self.last_save = now
+            snapshot = json.dumps({
+                'counters': self.counters, 'gauges': self.gauges,
+                'histograms': self.histograms})
+        filename = self._filename(os.getpid())
+        with open(f'{filename}.tmp', 'w') as json_file:
+            json_file.write(snapshot)
+        os.replace(f'{filename}.tmp', filename)
+
+    def _snapshots(self):
+        if self.folder is None:
+            with self.lock:
+                yield json.loads(json.dumps({
+                    'counters': self.counters, 'gauges': self.gauges,
+                    'histograms': self.histograms})), True
+            return
+        self.save()
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.folder, name)) as json_file:
+                    snapshot = json.load(json_file)
+            except (OSError, ValueError):
+                continue
+            yield snapshot, pid_is_running(int(name[:-len('.json')]))
+
+    def render(self):
+        '''
+        Metrics of all processes, in Prometheus text format
+        '''
+        counters = {}
+        gauges = {}
+        histograms = {}
+        for snapshot, running in self._snapshots():
+            for name, values in snapshot['counters'].items():
+                total = counters.setdefault(name, {})
+                for key, value in values.items():
+                    total[key] = total.get(key, 0) + value
+            if running:
+                for name, values in snapshot['gauges'].items():
+                    total = gauges.setdefault(name, {})
+                    for key, value in values.items():
+                        total[key] = total.get(key, 0) + value
+            for name, values in snapshot['histograms'].items():
+                total = histograms.setdefault(name, {})
+                for key, value in values.items():
+                    if key in total:
+                        total[key] = [a + b for a, b in zip(total[key], value)]
+                    else:
+                        total[key] = value
+
+        lines = []
+        for kind, metrics in (('counter', counters), ('gauge', gauges)):
+            for name, values in sorted(metrics.items()):
+                lines += self._header(name, kind)
+                for key, value in sorted(values.items()):
+                    labels = dict(json.loads(key))
+                    lines.append(
+                        f'{self.prefix}_{name}{_labels_text(labels)} {value}')
+        for name, values in sorted(histograms.items()):
+            lines += self._header(name, 'histogram')
+            full_name = f'{self.prefix}_{name}'
+            for key, histogram in sorted(values.items()):
+                labels = dict(json.loads(key))
+                # Bucket counts are cumulative, i.e. observations <= bound
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(
+                        f'{full_name}_bucket'
+                        f'{_labels_text(labels, le=bound)} {count}')
+                lines.append(
+                    f'{full_name}_bucket{_labels_text(labels, le="+Inf")} '
+                    f'{histogram[-1]}')
+                lines.append(
+                    f'{full_name}_sum{_labels_text(labels)} {histogram[-2]}')
+                lines.append(
+                    f'{full_name}_count{_labels_text(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name, kind):
+        lines = []
+        if name in self.descriptions:
+            lines.append(
+                f'# HELP {self.prefix}_{name} {self.descriptions[name]}')
+        lines.append(f'# TYPE {self.prefix}_{name} {kind}')
+        return lines
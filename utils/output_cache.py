@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where manifests are then not locked
+    fcntl = None
+
+import numpy as np
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _update_hash(sha1, part):
+    if isinstance(part, np.ndarray):
+        sha1.update(f'ndarray{part.dtype.str}{part.shape}'.encode())
+        sha1.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, (list, tuple)):
+        sha1.update(f'{type(part).__name__}{len(part)}'.encode())
+        for p in part:
+            _update_hash(sha1, p)
+    elif isinstance(part, dict):
+        sha1.update(f'dict{len(part)}'.encode())
+        for k, v in sorted(part.items(), key=lambda item: repr(item[0])):
+            _update_hash(sha1, k)
+            _update_hash(sha1, v)
+    elif isinstance(part, bytes):
+        sha1.update(b'bytes' + part)
+    else:
+        sha1.update(f'{type(part).__name__}:{part!r}'.encode())
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    '''
+    Hold an exclusive lock of file (created if needed), between processes
+    '''
+    if fcntl is None:
+        yield
+        return
+    with open(filename, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def content_hash(*parts):
+    '''
+    sha1 hex digest of arrays, containers and simple values
+    '''
+    sha1 = hashlib.sha1()
+    for part in parts:
+        _update_hash(sha1, part)
+    return sha1.hexdigest()
+
+
+class OutputCache():
+    '''
+    Manifest of output files in a folder, with the hash of their inputs
+
+    An output is fresh if the file exists and was written from inputs with
+    the same hash, so it can be skipped. The manifest is kept as
+    'manifest.json' next to the outputs.
+    '''
+    def __init__(self, folder):
+        self.filename = os.path.join(folder, MANIFEST_NAME)
+        self.entries = self._read()
+        self.updates = {}
+
+    def _read(self):
+        try:
+            with open(self.filename) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return {}
+
+    def fresh(self, filename, key):
+        name = os.path.basename(filename)
+        return os.path.exists(filename) and self.entries.get(name) == key
+
+    def record(self, filename, key):
+        name = os.path.basename(filename)
+        self.entries[name] = key
+        self.updates[name] = key
+
+    def save(self):
+        '''
+        Write recorded entries to manifest
+
+        The manifest is re-read first, to not lose entries written by some
+        other process using the same folder, e.g. datahandlers run with
+        --jobs. The read, merge and write is done holding a file lock.
+        '''
+        if not self.updates:
+            return
+        # Lock a separate file, as the manifest itself is replaced
+        with file_lock(f'{self.filename}.lock'):
+            entries = {**self._read(), **self.updates}
+            tmp_filename = f'{self.filename}.{os.getpid()}.tmp'
+            with open(tmp_filename, 'w') as json_file:
+                json.dump(entries, json_file, indent=4, sort_keys=True)
+            os.replace(tmp_filename, self.filename)
+        self.entries = entries
+        self.updates = {}
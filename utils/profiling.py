@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import contextlib
+import tracemalloc
+
+
+class Profiler():
+    '''
+    Record wall time, cpu time, peak memory and saved figures per stage
+
+    Stages are e.g. loading the logbook, or computing inputs of and running
+    a datahandler. Saved figures are counted as files written to the save
+    folder during the stage. Peak memory is measured with tracemalloc,
+    which makes e.g. plotting several times slower, so it can be turned off
+    to get accurate times.
+
+    Args:
+      enabled: if False, stages are not recorded
+      memory: measure peak memory
+      cprofile_datahandler: name of datahandler to also run with cProfile
+    '''
+    def __init__(self, enabled=True, memory=True, cprofile_datahandler=None):
+        self.enabled = enabled
+        self.memory = memory
+        self.cprofile_datahandler = cprofile_datahandler
+        self.stages = []
+        self.cprofile_stats = None
+        if enabled and memory:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, datahandler=None, save_dir=None):
+        if not self.enabled:
+            yield
+            return
+
+        profile = None
+        if datahandler is not None and name == 'run' and (
+                datahandler == self.cprofile_datahandler):
+            profile = cProfile.Profile()
+
+        files = file_times(save_dir)
+        if self.memory:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.cprofile_stats = pstats.Stats(profile)
+            stage = {
+                'name': name,
+                'datahandler': datahandler,
+                'wall': time.perf_counter() - wall,
+                'cpu': time.process_time() - cpu,
+                'peak_mb': None,
+                'figures': sum(
+                    1 for path, mtime in file_times(save_dir).items()
+                    if files.get(path) != mtime),
+                }
+            if self.memory:
+                # Peak, relative memory at start of stage
+                stage['peak_mb'] = (
+                    tracemalloc.get_traced_memory()[1] - memory) / 2**20
+            self.stages.append(stage)
+
+    def report(self):
+        '''
+        Report as dict, with stages and totals per datahandler
+        '''
+        datahandlers = {}
+        for stage in self.stages:
+            if stage['datahandler'] is None:
+                continue
+            total = datahandlers.setdefault(
+                stage['datahandler'],
+                {'wall': 0, 'cpu': 0, 'peak_mb': None, 'figures': 0})
+            total['wall'] += stage['wall']
+            total['cpu'] += stage['cpu']
+            if stage['peak_mb'] is not None:
+                total['peak_mb'] = max(total['peak_mb'] or 0, stage['peak_mb'])
+            total['figures'] += stage['figures']
+        return {
+            'stages': self.stages,
+            'datahandlers': datahandlers,
+            'total': {
+                'wall': sum(s['wall'] for s in self.stages),
+                'cpu': sum(s['cpu'] for s in self.stages)},
+            }
+
+    def save(self, filename):
+        '''
+        Write report as json, and print summary. If a datahandler was run
+        with cProfile, stats are saved to '<filename without .json>.prof'
+        '''
+        if not self.enabled:
+            return
+        report = self.report()
+        with open(filename, 'w') as json_file:
+            json.dump(report, json_file, indent=4)
+
+        print(f"{'stage':40s} {'wall':>8s} {'cpu':>8s} {'peak MB':>8s} "
+              f"{'figures':>7s}")
+        for stage in self.stages:
+            name = stage['name']
+            if stage['datahandler'] is not None:
+                name = f"{stage['datahandler']} {name}"
+            peak_mb = stage['peak_mb']
+            peak_mb = '-' if peak_mb is None else f'{peak_mb:.1f}'
+            print(f"{name:40s} {stage['wall']:8.3f} {stage['cpu']:8.3f} "
+                  f"{peak_mb:>8s} {stage['figures']:7d}")
+        if self.memory:
+            print("Times include overhead of measuring memory, use "
+                  "--profile-no-memory for accurate times")
+        print(f"Profile report written to {filename}")
+
+        if self.cprofile_stats is not None:
+            prof_filename = os.path.splitext(filename)[0] + '.prof'
+            self.cprofile_stats.dump_stats(prof_filename)
+            print(f"cProfile of {self.cprofile_datahandler} written to "
+                  f"{prof_filename}")
+            self.cprofile_stats.sort_stats('cumulative').print_stats(25)
+
+
+def file_times(folder):
+    '''
+    Dict of modification time of files in folder (recursively), except
+    manifests of the output cache (and their lock files)
+    '''
+    times = {}
+    if folder is None:
+        return times
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.startswith('manifest.json'):
+                continue
+            path = os.path.join(root, name)
+            times[path] = os.stat(path).st_mtime_ns
+    return times
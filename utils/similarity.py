@@ -0,0 +1,226 @@
+import numpy as np
+
+from utils.holdsets import NUM_HOLDS, hold_ids
+from utils.store import pack_holds, unpack_holds
+
+
+def popcount(words):
+    '''
+    Number of set bits of uint64 array, summed over the last axis
+    '''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+    # numpy < 2.0, count bits per byte
+    words = np.ascontiguousarray(words, dtype='<u8')
+    counts = _BYTE_COUNTS[words.view(np.uint8)]
+    return counts.reshape(*words.shape[:-1], -1).sum(axis=-1, dtype=np.int32)
+
+
+_BYTE_COUNTS = np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def minhash(hold_matrix, ranks):
+    '''
+    MinHash signatures of hold sets
+
+    Args:
+      hold_matrix: bool matrix (n, NUM_HOLDS)
+      ranks: int array (num_hashes, NUM_HOLDS), one permutation of the
+        hold ids per hash
+
+    Return:
+      uint8 array (n, num_hashes), with the lowest rank of the holds of each
+      problem, or NUM_HOLDS if no holds
+    '''
+    signatures = np.full(
+        (len(hold_matrix), len(ranks)), NUM_HOLDS, dtype=np.uint8)
+    rows, holds = np.nonzero(hold_matrix)
+    if len(rows):
+        # Minimum over the holds of each problem, rows are sorted
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        signatures[rows[starts]] = np.minimum.reduceat(
+            ranks[:, holds].T, starts, axis=0)
+    return signatures
+
+
+class SimilarityIndex():
+    '''
+    Index of a ProblemStore, to find problems with similar holds
+
+    Similarity is the Jaccard overlap of the hold sets of two problems,
+    computed with popcount on the packed hold bitmasks of the store.
+    Candidates are first found with MinHash and LSH: the signatures are
+    split in bands, and problems with an equal band (same bucket) as the
+    query are candidates. With the default 16 bands of 2 hashes, problems
+    with a similarity of 0.5 are found with about 99% probability. If there
+    are too few candidates, all problems are scanned. Small stores are
+    always scanned, which is then faster than looking up the buckets.
+
+    Args:
+      store: ProblemStore
+      num_hashes: number of MinHash hashes
+      bands: number of LSH bands, num_hashes / bands must be at most 8
+      seed: random seed of the hash permutations
+      min_lsh_size: scan all problems of stores smaller than this
+    '''
+    def __init__(self, store, num_hashes=32, bands=16, seed=0,
+                 min_lsh_size=10000):
+        rows_per_band = num_hashes // bands
+        if rows_per_band * bands != num_hashes or not 1 <= rows_per_band <= 8:
+            raise ValueError(
+                f"num_hashes:{num_hashes} must be 1-8 times bands:{bands}")
+        self.store = store
+        self.holds = np.ascontiguousarray(store.holds)
+        # Number of holds of each problem
+        self.counts = popcount(self.holds)
+        self.rows_per_band = rows_per_band
+        self.min_lsh_size = min_lsh_size
+
+        rng = np.random.default_rng(seed)
+        self.ranks = np.array(
+            [rng.permutation(NUM_HOLDS) for _ in range(num_hashes)],
+            dtype=np.uint8)
+        signatures = minhash(store.hold_matrix(), self.ranks)
+
+        # Per band, bucket keys of all problems sorted, and the rows in
+        # that order. The problems of a bucket are then a range found with
+        # searchsorted
+        self.band_keys = []
+        self.band_rows = []
+        for keys in self._band_keys(signatures):
+            order = np.argsort(keys, kind='stable')
+            self.band_keys.append(keys[order])
+            self.band_rows.append(order)
+
+        # Row of each apiId
+        self.api_id_order = np.argsort(store.api_id, kind='stable')
+        self.sorted_api_id = store.api_id[self.api_id_order]
+
+    def __len__(self):
+        return len(self.store)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(len={len(self)})'
+
+    def _band_keys(self, signatures):
+        # Each band of hashes (uint8) combined into one uint64 key
+        signatures = signatures.astype(np.uint64)
+        r = self.rows_per_band
+        for band in range(len(self.ranks) // r):
+            keys = np.zeros(len(signatures), dtype=np.uint64)
+            for j in range(r):
+                keys |= signatures[:, band*r + j] << np.uint64(8*j)
+            yield keys
+
+    def row(self, api_id):
+        '''
+        Row of problem with apiId in store, or None if not in store
+        '''
+        i = np.searchsorted(self.sorted_api_id, api_id)
+        if i == len(self.sorted_api_id) or self.sorted_api_id[i] != api_id:
+            return None
+        return int(self.api_id_order[i])
+
+    def candidates(self, mask):
+        '''
+        Rows of problems sharing an LSH bucket with hold bitmask
+        '''
+        signature = minhash(unpack_holds(mask), self.ranks)
+        rows = []
+        for keys, band_rows, key in zip(
+                self.band_keys, self.band_rows, self._band_keys(signature)):
+            start = np.searchsorted(keys, key[0], side='left')
+            stop = np.searchsorted(keys, key[0], side='right')
+            rows.append(band_rows[start:stop])
+        return np.unique(np.concatenate(rows))
+
+    def similarity(self, mask, rows=None):
+        '''
+        Jaccard overlap of hold bitmask with problems at rows (default all)
+        '''
+        if rows is None:
+            holds, counts = self.holds, self.counts
+        else:
+            holds, counts = self.holds[rows], self.counts[rows]
+        # |a or b| = |a| + |b| - |a and b|
+        intersection = popcount(holds & mask)
+        union = counts + popcount(mask) - intersection
+        return intersection / np.maximum(union, 1)
+
+    def query(self, api_id=None, holds=None, k=10, grades=None, exact=False):
+        '''
+        Most similar problems to a problem, or to a set of holds
+
+        Args:
+          api_id: apiId of problem (in the store), excluded from the result
+          holds: list of hold descriptions, e.g. ['E6', 'A18'], if no api_id
+          k: number of problems to return
+          grades: str grade or list of grades to keep, e.g. ['7A', '7A+']
+          exact: scan all problems, instead of only LSH candidates (always
+            for stores smaller than min_lsh_size)
+
+        Return:
+          list of dicts with apiId, name, grade and similarity, most similar
+          first. Raises KeyError if api_id is not in the store, and ValueError
+          if neither api_id nor valid holds are given
+        '''
+        exclude = None
+        if api_id is not None:
+            exclude = self.row(api_id)
+            if exclude is None:
+                raise KeyError(f"apiId:{api_id} not in index")
+            mask = self.holds[exclude]
+        else:
+            ids = hold_ids(list(holds or []))
+            ids = ids[ids >= 0]
+            if not len(ids):
+                raise ValueError("No valid holds given")
+            matrix = np.zeros((1, NUM_HOLDS), dtype=bool)
+            matrix[0, ids] = True
+            mask = pack_holds(matrix)[0]
+
+        # Codes of the grades to keep
+        codes = None
+        if grades is not None:
+            if isinstance(grades, str):
+                grades = [grades]
+            codes = [self.store.grades.index(g) for g in grades
+                     if g in self.store.grades]
+
+        exact = exact or len(self) < self.min_lsh_size
+        rows = None if exact else self.candidates(mask)
+        rows = self._filter(rows, exclude, codes)
+        if rows is not None and len(rows) < k:
+            # Too few candidates, scan all instead
+            rows = self._filter(None, exclude, codes)
+        if rows is None:
+            rows = np.arange(len(self))
+
+        similarity = self.similarity(mask, rows)
+        # Top k, most similar first
+        if len(rows) > k:
+            top = np.argpartition(-similarity, k-1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-similarity[top], kind='stable')]
+
+        store = self.store
+        return [{
+            'apiId': int(store.api_id[row]),
+            'name': str(store.names[row]),
+            'grade': store.grade_str(store.grade[row]),
+            'similarity': float(s),
+        } for row, s in zip(rows[top].tolist(), similarity[top].tolist())]
+
+    def _filter(self, rows, exclude, codes):
+        # Filter rows (None for all) on grade codes, and exclude a row
+        if exclude is None and codes is None:
+            return rows
+        if rows is None:
+            rows = np.arange(len(self))
+        if codes is not None:
+            rows = rows[np.isin(self.store.grade[rows], codes)]
+        if exclude is not None:
+            rows = rows[rows != exclude]
+        return rows
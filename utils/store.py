@@ -0,0 +1,391 @@
+import os
+import functools
+from array import array
+
+import numpy as np
+
+from utils.utils import Problem
+from utils.holdsets import NUM_HOLDS, HOLD_IDS, HOLD_DESCRIPTIONS
+
+
+# Number of uint64 words needed for one hold bitmask
+NUM_WORDS = (NUM_HOLDS + 63) // 64
+
+
+def pack_holds(hold_matrix):
+    '''
+    Pack bool matrix (n, NUM_HOLDS) into uint64 bitmasks (n, NUM_WORDS)
+    '''
+    hold_matrix = np.asarray(hold_matrix, dtype=bool).reshape(-1, NUM_HOLDS)
+    padded = np.zeros((len(hold_matrix), NUM_WORDS*64), dtype=bool)
+    padded[:, :NUM_HOLDS] = hold_matrix
+    packed = np.packbits(padded, axis=1, bitorder='little')
+    return packed.view('<u8').reshape(-1, NUM_WORDS)
+
+
+def unpack_holds(masks):
+    '''
+    Unpack uint64 bitmasks (n, NUM_WORDS) into bool matrix (n, NUM_HOLDS)
+    '''
+    masks = np.ascontiguousarray(masks, dtype='<u8').reshape(-1, NUM_WORDS)
+    bits = np.unpackbits(masks.view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :NUM_HOLDS].astype(bool)
+
+
+class ProblemStore():
+    '''
+    Columnar store of problems, backed by numpy arrays
+
+    Grades are stored as codes, i.e. indices into 'grades' (-1 if missing),
+    and holds as bitmasks of 'NUM_WORDS' uint64 words per problem, with a
+    bit per hold id (see utils.holdsets).
+    '''
+    columns = (
+        'api_id', 'grade', 'user_grade', 'repeats', 'is_benchmark',
+        'holds', 'start', 'end', 'names')
+
+    def __init__(self, api_id, grade, user_grade, repeats, is_benchmark,
+                 holds, start, end, names, grades):
+        self.api_id = api_id
+        self.grade = grade
+        self.user_grade = user_grade
+        self.repeats = repeats
+        self.is_benchmark = is_benchmark
+        self.holds = holds
+        self.start = start
+        self.end = end
+        self.names = names
+        self.grades = list(grades)
+
+    @classmethod
+    def from_dicts(cls, problem_dicts):
+        '''
+        Construct store from an iterable of problem dicts (as in the json)
+
+        Dicts are consumed one at a time, and only compact columns are kept,
+        so 'problem_dicts' can be a generator streaming from file.
+        '''
+        api_id = array('q')
+        grade = []
+        user_grade = []
+        repeats = array('l')
+        is_benchmark = array('b')
+        names = []
+        # Hold indices as flat (problem row, hold index) pairs
+        holds = (array('l'), array('l'))
+        start = (array('l'), array('l'))
+        end = (array('l'), array('l'))
+
+        for row, problem in enumerate(problem_dicts):
+            api_id.append(problem['apiId'])
+            grade.append(problem['grade'])
+            user_grade.append(problem.get('userGrade'))
+            repeats.append(problem.get('repeats') or 0)
+            is_benchmark.append(bool(problem.get('isBenchmark')))
+            names.append(problem.get('name', ''))
+
+            # Collect hold ids of the moves
+            for move in problem['moves']:
+                index = HOLD_IDS.get(move['description'])
+                if index is None:
+                    continue
+                cls._append(holds, row, index)
+                if move.get('isStart'):
+                    cls._append(start, row, index)
+                if move.get('isEnd'):
+                    cls._append(end, row, index)
+
+        # Map str grades to int codes
+        grades = sorted(set(g for g in grade + user_grade if g is not None))
+        grade_to_code = {g: i for i, g in enumerate(grades)}
+        grade_to_code[None] = -1
+
+        num_problems = len(api_id)
+        return cls(
+            api_id=np.array(api_id, dtype=np.int64),
+            grade=np.array(
+                [grade_to_code[g] for g in grade], dtype=np.int8),
+            user_grade=np.array(
+                [grade_to_code[g] for g in user_grade], dtype=np.int8),
+            repeats=np.array(repeats, dtype=np.int32),
+            is_benchmark=np.array(is_benchmark, dtype=bool),
+            holds=cls._masks(holds, num_problems),
+            start=cls._masks(start, num_problems),
+            end=cls._masks(end, num_problems),
+            names=np.array(names, dtype=str),
+            grades=grades,
+        )
+
+    @staticmethod
+    def _append(pairs, row, index):
+        pairs[0].append(row)
+        pairs[1].append(index)
+
+    @staticmethod
+    def _masks(pairs, num_problems):
+        '''
+        (problem rows, hold indices) -> bitmasks
+        '''
+        matrix = np.zeros((num_problems, NUM_HOLDS), dtype=bool)
+        matrix[np.array(pairs[0], dtype=np.intp),
+               np.array(pairs[1], dtype=np.intp)] = True
+        return pack_holds(matrix)
+
+    def __len__(self):
+        return len(self.api_id)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(len={len(self)})'
+
+    def subset(self, index):
+        '''
+        New store with the problems selected by 'index' (bool mask or ints)
+        '''
+        return self.__class__(
+            **{c: getattr(self, c)[index] for c in self.columns},
+            grades=self.grades)
+
+    def benchmarks(self):
+        return self.subset(self.is_benchmark)
+
+    def hold_matrix(self, kind='holds'):
+        '''
+        Bool matrix (n, NUM_HOLDS) of 'holds', 'start' or 'end' holds
+        '''
+        return unpack_holds(getattr(self, kind))
+
+    def used_grades(self, kind='grade'):
+        '''
+        Sorted list of str grades used by at least one problem
+        '''
+        codes = np.unique(getattr(self, kind))
+        return [self.grades[c] for c in codes if c >= 0]
+
+    def grade_str(self, code):
+        return self.grades[code] if code >= 0 else None
+
+    def hold_ids(self, i):
+        '''
+        Hold ids of row i, and bool arrays of which are start and end holds
+        '''
+        ids = np.flatnonzero(unpack_holds(self.holds[i])[0])
+        is_start = unpack_holds(self.start[i])[0][ids]
+        is_end = unpack_holds(self.end[i])[0][ids]
+        return ids, is_start, is_end
+
+    def moves(self, i):
+        '''
+        List of move dicts of row i
+        '''
+        ids, is_start, is_end = self.hold_ids(i)
+        descriptions = HOLD_DESCRIPTIONS[ids].tolist()
+        return [{
+            'description': description,
+            'isStart': start,
+            'isEnd': end,
+        } for description, start, end in zip(
+            descriptions, is_start.tolist(), is_end.tolist())]
+
+    def problem(self, i):
+        '''
+        Construct a Problem object for row i. Moves are decoded from the hold
+        masks only when read
+        '''
+        return Problem(
+            moves=functools.partial(self.moves, i),
+            apiId=int(self.api_id[i]),
+            name=str(self.names[i]),
+            grade=self.grade_str(self.grade[i]),
+            userGrade=self.grade_str(self.user_grade[i]),
+            repeats=int(self.repeats[i]),
+            isBenchmark=bool(self.is_benchmark[i]),
+        )
+
+    @property
+    def problem_list(self):
+        return ProblemList(self)
+
+    def save(self, filename, **meta):
+        '''
+        Save store as uncompressed .npz, with optional extra 'meta' arrays
+        '''
+        arrays = {c: getattr(self, c) for c in self.columns}
+        arrays['grades'] = np.array(self.grades, dtype=str)
+        arrays.update({f'meta_{k}': np.asarray(v) for k, v in meta.items()})
+        # Write to temporary file and rename, to never leave a partial file
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'wb') as npz_file:
+            np.savez(npz_file, **arrays)
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load store saved by 'save'
+
+        Return:
+          (store, meta_dict)
+        '''
+        with np.load(filename) as npz:
+            store = cls(
+                **{c: npz[c] for c in cls.columns},
+                grades=npz['grades'].tolist())
+            meta = {
+                k[len('meta_'):]: npz[k][()] for k in npz.files
+                if k.startswith('meta_')}
+        return store, meta
+
+
+class ProblemList():
+    '''
+    Thin list-like view of a ProblemStore, giving Problem objects
+
+    Problem objects are constructed on access, so code only using the
+    arrays of the store never pays for them.
+    '''
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.problem(j) for j in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('ProblemList index out of range')
+        return self.store.problem(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.store.problem(i)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.store})'
+
+
+def hold_frequency(stores, grades, kind='grade'):
+    '''
+    Count how many problems use each hold, per store and grade, in one pass
+
+    Args:
+      stores: list of ProblemStore, e.g. one per holdset
+      grades: list of str grades, defining the grade axis
+      kind: grade used for grouping, 'grade' or 'user_grade'
+    Return:
+      int array (len(stores), len(grades), NUM_HOLDS)
+    '''
+    grade_to_index = {g: i for i, g in enumerate(grades)}
+    keys = []
+    for store_index, store in enumerate(stores):
+        # Lookup from store grade code to index on grade axis, with last
+        # element used for missing grades (code -1)
+        lookup = np.array(
+            [grade_to_index.get(g, -1) for g in store.grades] + [-1],
+            dtype=np.intp)
+        grade_index = lookup[getattr(store, kind)]
+
+        # All (problem, hold) pairs, as flat index into output array
+        rows, holds = np.nonzero(store.hold_matrix())
+        grade_index = grade_index[rows]
+        valid = grade_index >= 0
+        keys.append(
+            (store_index * len(grades) + grade_index[valid]) * NUM_HOLDS
+            + holds[valid])
+
+    shape = (len(stores), len(grades), NUM_HOLDS)
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.intp)
+    counts = np.bincount(keys, minlength=int(np.prod(shape)))
+    return counts.reshape(shape)
+
+
+def parse_entry_dates(entry_dates):
+    '''
+    Parse logbook entry dates, e.g. '2021-03-04T18:12:45.123', to datetime64
+
+    Fractions of seconds are removed.
+    '''
+    return np.array(
+        [d.split('.')[0] for d in entry_dates], dtype='datetime64[s]')
+
+
+class LogbookStore():
+    '''
+    Columnar view of logbook entries, with entry dates parsed once
+
+    Rows are in the order of 'logbook_dict', and 'index' maps apiId to row.
+    Weekdays are 0-6 for Monday-Sunday and months 1-12.
+    '''
+    def __init__(self, logbook_dict):
+        entries = list(logbook_dict.values())
+        self.api_id = np.array([e.apiId for e in entries], dtype=np.int64)
+        self.index = {api_id: i for i, api_id in enumerate(logbook_dict)}
+
+        # Parse dates, and derive calendar fields
+        self.dates = parse_entry_dates([e.entryDate for e in entries])
+        days = self.dates.astype('datetime64[D]')
+        # 1970-01-01 was a Thursday
+        self.weekday = (days.astype(np.int64) + 3) % 7
+        seconds = (self.dates - days).astype(np.int64)
+        self.hour = seconds // 3600
+        self.minute = seconds // 60 % 60
+        self.month = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+    def __len__(self):
+        return len(self.api_id)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(len={len(self)})'
+
+    def rows(self, api_ids):
+        '''
+        Rows of the given apiIds, as int array
+        '''
+        return np.array([self.index[i] for i in api_ids], dtype=np.intp)
+
+
+class LogbookJoin():
+    '''
+    Logbook entries of the problems in a ProblemStore, sorted by entry date
+
+    Attributes:
+      rows: rows in LogbookStore
+      problem_rows: rows of the matching problems in ProblemStore
+      grades: grade codes of the problems, see ProblemStore.grades
+      dates: datetime64 entry dates
+    '''
+    def __init__(self, logbook_store, problem_store):
+        self.problem_grades = problem_store.grades
+
+        # Match logbook apiIds against sorted problem apiIds
+        order = np.argsort(problem_store.api_id, kind='stable')
+        sorted_ids = problem_store.api_id[order]
+        position = np.searchsorted(sorted_ids, logbook_store.api_id)
+        position = np.minimum(position, max(len(sorted_ids)-1, 0))
+        found = (sorted_ids[position] == logbook_store.api_id
+                 if len(sorted_ids) else np.zeros(len(logbook_store), bool))
+        rows = np.flatnonzero(found)
+
+        # Sort by entry date
+        by_date = np.argsort(logbook_store.dates[rows], kind='stable')
+        self.rows = rows[by_date]
+        self.problem_rows = order[position[self.rows]]
+        self.grades = problem_store.grade[self.problem_rows]
+        self.dates = logbook_store.dates[self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(len={len(self)})'
+
+    def grade_ints(self, grade_int_mapping):
+        '''
+        Grades as ints of 'grade_int_mapping' (-1 if not in mapping)
+        '''
+        lookup = np.array(
+            [grade_int_mapping.get(g, -1) for g in self.problem_grades]
+            + [-1], dtype=np.int64)
+        return lookup[self.grades]
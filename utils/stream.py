@@ -0,0 +1,130 @@
+import json
+
+
+class _JsonReader():
+    '''
+    Minimal incremental reader of json text from a file
+
+    Only a window of the file is kept in memory, and values are decoded one
+    at a time using 'json.JSONDecoder.raw_decode'.
+    '''
+    whitespace = ' \t\n\r'
+    number_chars = '0123456789.eE+-'
+
+    def __init__(self, json_file, chunk_size=1 << 16):
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read(self, size=None):
+        '''
+        Read more data into buffer. Return False at end of file
+        '''
+        if self.eof:
+            return False
+        # Drop consumed part of buffer
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        # Grow read size with buffer, to avoid quadratic cost on big values
+        chunk = self.json_file.read(max(size or 0, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        '''
+        Skip whitespace and return next character ('' at end of file)
+        '''
+        while True:
+            while (self.pos < len(self.buffer)
+                   and self.buffer[self.pos] in self.whitespace):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f"Expected one of '{chars}' but got '{char}' in json file")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        '''
+        Decode next json value
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Possibly value not fully read yet
+                if not self.read(len(self.buffer) - self.pos):
+                    raise
+                continue
+            # A number could continue in the next chunk, e.g. '1.' + '5'
+            continued = end == len(self.buffer) or (
+                isinstance(value, (int, float))
+                and self.buffer[end] in self.number_chars)
+            if continued and self.read():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        '''
+        Iterate values of json array starting at current position
+        '''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_json_array(filename, key='data', chunk_size=1 << 16):
+    '''
+    Iterate items of a json array, one item at a time
+
+    The file is read incrementally, so memory use does not depend on the size
+    of the file. Works for files with an array at top-level (e.g. logbook),
+    or with the array as a top-level value of 'key' (e.g. problems files).
+
+    Args:
+      filename: path to json file
+      key: key of array in top-level object
+      chunk_size: number of characters to read at a time
+    '''
+    with open(filename) as json_file:
+        reader = _JsonReader(json_file, chunk_size=chunk_size)
+
+        if reader.peek() == '[':
+            yield from reader.iter_array()
+            return
+
+        # Loop top-level object until 'key' is found
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            name = reader.decode()
+            reader.expect(':')
+            if name == key and reader.peek() == '[':
+                yield from reader.iter_array()
+                return
+            # Decode and drop other values
+            reader.decode()
+            if reader.expect(',}') == '}':
+                return
@@ -1,10 +1,41 @@
 import argparse
+from collections.abc import Mapping
 
 
-class Move():
+class Record():
+    """
+    Base of records with fixed fields, stored in __slots__ instead of a
+    per-object __dict__
+
+    Kwargs of fields in '__slots__' are set as attributes, other kwargs are
+    kept in the 'extra' dict (None if there are none), and can still be
+    read as attributes.
+
+    In: Move(description='E6', isStart=True, isEnd=False, holdId=3).holdId
+    Out: 3
+    """
+    __slots__ = ('extra',)
+
     def __init__(self, **kwargs):
-        # Assign kwargs directly to __dict__
-        self.__dict__ = kwargs
+        self.extra = None
+        for key, value in kwargs.items():
+            if key in self.__slots__:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def __getattr__(self, key):
+        # Only called if not a (set) slot
+        if key != 'extra' and self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise AttributeError(
+            f"'{self.__class__.__name__}' object has no attribute '{key}'")
+
+
+class Move(Record):
+    __slots__ = ('problemId', 'description', 'isStart', 'isEnd')
 
     def __repr__(self):
         # Some compact formatting
@@ -16,15 +47,33 @@ class Move():
         return f"'{message}'"
 
 
-class Problem():
-    def __init__(self, moves=None, **kwargs):
-        # Assign kwargs directly to __dict__
-        self.__dict__ = kwargs
+class Problem(Record):
+    """
+    Problem, with moves decoded to Move objects on first access of 'moves'
 
-        # list[move_dict] -> list[Move]
-        self.moves = []
-        for move_dict in moves:
-            self.moves.append(Move(**move_dict))
+    'moves' is a list of move dicts, or a function returning it, e.g. to
+    not even construct the dicts unless needed.
+    """
+    __slots__ = (
+        'apiId', 'name', 'grade', 'userGrade', 'repeats', 'isBenchmark',
+        'setby', 'setbyId', 'method', 'userRating', 'holdsetup',
+        'dateInserted', '_raw_moves', '_moves')
+
+    def __init__(self, moves=None, **kwargs):
+        super().__init__(**kwargs)
+        self._raw_moves = moves
+        self._moves = None
+
+    @property
+    def moves(self):
+        if self._moves is None:
+            raw_moves = self._raw_moves
+            if callable(raw_moves):
+                raw_moves = raw_moves()
+            # list[move_dict] -> list[Move]
+            self._moves = [Move(**move_dict) for move_dict in raw_moves or []]
+            self._raw_moves = None
+        return self._moves
 
     def __repr__(self):
         message = f"name='{self.name}',grade='{self.grade}',moves={self.moves}"
@@ -32,10 +81,13 @@ class Problem():
         return f'{self.__class__.__name__}({message})'
 
 
-class LogbookEntry():
+class LogbookEntry(Record):
+    __slots__ = (
+        'apiId', 'grade', 'entryDate', 'attempts', 'comment', 'rating',
+        'isRepeat')
+
     def __init__(self, problem, **kwargs):
-        # Assign kwargs directly to __dict__
-        self.__dict__ = kwargs
+        super().__init__(**kwargs)
 
         # Retrieve apiId from 'problem'
         self.apiId = problem['apiId']
@@ -94,3 +146,56 @@ def add_dicts(dict1, dict2):
             dict1[key] = dict2[key]
 
     return dict1
+
+
+class LazyData(Mapping):
+    """
+    Dict-like container where values are computed on first access
+
+    Producers are functions taking the LazyData itself as argument, so they
+    can in turn access (and trigger computation of) other values. A producer
+    can produce several keys at once by returning a tuple.
+
+    In: LazyData(a=1).add('b', lambda data: data['a'] + 1)['b']
+    Out: 2
+    """
+    def __init__(self, **values):
+        self._values = dict(values)
+        self._producers = {}
+
+    def add(self, keys, producer):
+        if isinstance(keys, str):
+            self._producers[keys] = (keys, producer)
+        else:
+            for key in keys:
+                self._producers[key] = (tuple(keys), producer)
+        return self
+
+    def update(self, values):
+        self._values.update(values)
+
+    def computed(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._producers:
+                raise KeyError(key)
+            keys, producer = self._producers[key]
+            produced = producer(self)
+            if isinstance(keys, str):
+                self._values[keys] = produced
+            else:
+                self._values.update(zip(keys, produced))
+        return self._values[key]
+
+    def __contains__(self, key):
+        # Don't trigger computation, as Mapping.__contains__ would
+        return key in self._values or key in self._producers
+
+    def __iter__(self):
+        yield from self._values
+        yield from (k for k in self._producers if k not in self._values)
+
+    def __len__(self):
+        return len(set(self._values) | set(self._producers))